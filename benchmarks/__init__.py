@@ -0,0 +1,18 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+## @package benchmarks
+#
+#  Offline performance benchmarks for fv3jeditools. Not installed with the package, run from the
+#  root of the repository:
+#
+#   python benchmarks/startup.py    | Startup cost of each application
+#   python -m benchmarks.run        | Time the applications on synthetic inputs of several sizes
+#
+#  benchmarks.synthetic generates the inputs: IODA hofx files, OOPS logs, cubed-sphere fields with
+#  matching fv3grid files and lat/lon fields.
+#
+# --------------------------------------------------------------------------------------------------
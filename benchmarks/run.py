@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import argparse
+import contextlib
+import datetime as dt
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks import synthetic
+
+# --------------------------------------------------------------------------------------------------
+## @package run
+#
+#  Time the fv3jeditools applications and raster.py on synthetic inputs of several sizes. The
+#  inputs are generated once per size under the output directory and reused by later runs.
+#
+#  The median time of each case is stored in <output>/results_<commit>.json so that results can be
+#  compared between commits. The file is written after each case, cases that fail are recorded
+#  with their error and skipped in comparisons:
+#
+#   python -m benchmarks.run [-s small medium] [-c case ...] [-r repeats] [-o output]
+#   python -m benchmarks.run --compare <commit a> <commit b>
+#
+#  The applications are run in this process with the Agg backend, raster.py as a subprocess.
+#
+# --------------------------------------------------------------------------------------------------
+
+# Sizes of the synthetic inputs
+sizes = {
+  'small':  {'nfiles': 2,  'nlocs': 20000,   'nchans': 15, 'niter': 25,  'members': 10,
+             'nfiller': 0,   'npx': 48,  'npz': 4,  'nlon': 144, 'nlat': 91},
+  'medium': {'nfiles': 6,  'nlocs': 200000,  'nchans': 15, 'niter': 100, 'members': 40,
+             'nfiller': 20,  'npx': 96,  'npz': 16, 'nlon': 360, 'nlat': 181},
+  'large':  {'nfiles': 12, 'nlocs': 2000000, 'nchans': 22, 'niter': 200, 'members': 80,
+             'nfiller': 200, 'npx': 192, 'npz': 32, 'nlon': 720, 'nlat': 361},
+}
+
+# Cycle used for all cases, the synthetic observations are in the window around it
+cycle = dt.datetime(2020, 1, 2, 0)
+
+# --------------------------------------------------------------------------------------------------
+
+def generate(data_path, size):
+
+    # Write the inputs for one size unless they are already there
+    done_file = os.path.join(data_path, 'complete')
+    if os.path.exists(done_file):
+        return
+
+    print(" Generating inputs in", data_path)
+    os.makedirs(data_path, exist_ok=True)
+
+    window_begin = cycle - dt.timedelta(hours=3)
+    for kind in ['exp', 'ref']:
+        synthetic.write_ioda_hofx_files(
+            os.path.join(data_path, kind+'.hofx.PT6H.x.amsua_n19.{}.nc4'),
+            size['nfiles'], size['nlocs'], nchans=size['nchans'], window_begin=window_begin)
+
+    synthetic.write_oops_log(os.path.join(data_path, 'var.log'), niter=size['niter'],
+                             nfiller=size['nfiller'])
+    synthetic.write_oops_log(os.path.join(data_path, 'block.log'), niter=size['niter'],
+                             members=size['members'], nfiller=size['nfiller'])
+
+    synthetic.write_fv3grid(os.path.join(data_path, 'fv3grid_c'+str(size['npx']).zfill(4)+'.nc4'),
+                            size['npx'])
+    synthetic.write_cube_fields(os.path.join(data_path, 'fields.nc'), size['npx'], size['npz'])
+    synthetic.write_latlon(os.path.join(data_path, 'latlon.nc4'), size['nlon'], size['nlat'],
+                           size['npz'])
+
+    open(done_file, 'w').close()
+
+# --------------------------------------------------------------------------------------------------
+
+def cases(data_path, plot_path, size):
+
+    # Application name and configuration of each case
+    def path(file):
+        return os.path.join(data_path, file)
+
+    output = {'output path': plot_path+os.sep}
+
+    return {
+      'hofx_map': ('hofx_map', dict(output, **{
+        'hofx files': path('exp.hofx.*.nc4'), 'metric': 'omb',
+        'field': 'brightness_temperature', 'channel': 7,
+        'window length': 6, 'time offset': 0})),
+      'hofx_innovations': ('hofx_innovations', dict(output, **{
+        'hofx files': path('exp.hofx.*.nc4'), 'field': 'brightness_temperature', 'channel': 7,
+        'number of outer loops': 2, 'window length': 6, 'time offset': 0})),
+      'obs_scatter': ('obs_scatter', dict(output, **{
+        'ioda experiment files': [path('exp.hofx.PT6H.x.amsua_n19.0000.nc4')],
+        'ioda reference files': [path('ref.hofx.PT6H.x.amsua_n19.0000.nc4')],
+        'experiment metrics': ['hofx'], 'reference metrics': ['GsiHofXBc']})),
+      'da_convergence': ('da_convergence', dict(output, **{'log file': path('var.log')})),
+      'da_block_convergence': ('da_block_convergence', dict(output, **{
+        'log file': path('block.log'), 'members': size['members']})),
+      'log_timing': ('log_timing', dict(output, **{'log file': path('var.log')})),
+      'field_plot': ('field_plot', dict(output, **{
+        'fields file': path('latlon.nc4'), 'field names': ['t'], 'model layer': 1})),
+      'raster': ('raster', None),
+    }
+
+# --------------------------------------------------------------------------------------------------
+
+def time_application(app_name, app_conf, repeats):
+
+    import copy
+    import fv3jeditools
+    import matplotlib.pyplot as plt
+
+    application = fv3jeditools.get_application(app_name)
+
+    times = []
+    for n in range(repeats):
+        conf = copy.deepcopy(app_conf)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            application(cycle, conf)
+            times.append(time.perf_counter() - start)
+        plt.close('all')
+
+    return times
+
+# --------------------------------------------------------------------------------------------------
+
+def time_raster(data_path, plot_path, repeats):
+
+    raster = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'src',
+                          'raster', 'raster.py')
+    env = dict(os.environ, FV3_GRID_DIR=data_path, MPLBACKEND='Agg')
+    command = [sys.executable, raster, '--gfs', '-f', os.path.join(data_path, 'fields.nc'),
+               '-v', 'T', '-l', '1', '-o', os.path.join(plot_path, 'raster')]
+
+    times = []
+    for n in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+
+    return times
+
+# --------------------------------------------------------------------------------------------------
+
+def commit_name():
+
+    # Short hash of the current commit, marked when the tree has local changes
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True,
+                                stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                check=True, stdout=subprocess.PIPE).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+    return commit+'-dirty' if status.strip() else commit
+
+# --------------------------------------------------------------------------------------------------
+
+def save_results(results_file, commit, results):
+
+    with open(results_file, 'w') as fh:
+        json.dump({'commit': commit, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python': sys.version.split()[0], 'results': results}, fh, indent=2)
+
+# --------------------------------------------------------------------------------------------------
+
+def compare(output_path, commit_a, commit_b):
+
+    results = []
+    for commit in [commit_a, commit_b]:
+        with open(os.path.join(output_path, 'results_'+commit+'.json')) as fh:
+            results.append(json.load(fh)['results'])
+
+    print("\n {:<8s} {:<22s} {:>12s} {:>12s} {:>8s}".format('size', 'case', commit_a, commit_b,
+                                                           'ratio'))
+    for size in results[0]:
+        for case, time_a in results[0][size].items():
+            time_b = results[1].get(size, {}).get(case)
+            if time_b is None:
+                continue
+            if 'failed' in time_a or 'failed' in time_b:
+                print(" {:<8s} {:<22s} {:>12s} {:>12s}".format(
+                      size, case, 'failed' if 'failed' in time_a else '',
+                      'failed' if 'failed' in time_b else ''))
+            else:
+                print(" {:<8s} {:<22s} {:>12.3f} {:>12.3f} {:>7.2f}x".format(
+                      size, case, time_a['median'], time_b['median'],
+                      time_a['median']/time_b['median']))
+    print("\n")
+
+# --------------------------------------------------------------------------------------------------
+
+def main():
+
+    sargs = argparse.ArgumentParser()
+    sargs.add_argument("-s", "--sizes", nargs='+', default=['small', 'medium'],
+                       choices=list(sizes.keys()))
+    sargs.add_argument("-c", "--cases", nargs='+', default=None)
+    sargs.add_argument("-r", "--repeats", type=int, default=3)
+    sargs.add_argument("-o", "--output", default='benchmark_output')
+    sargs.add_argument("--compare", nargs=2, metavar=('COMMIT_A', 'COMMIT_B'))
+    args = sargs.parse_args()
+
+    if args.compare is not None:
+        compare(args.output, *args.compare)
+        return
+
+    # Applications are timed without a display
+    import matplotlib
+    matplotlib.use('Agg')
+
+    # Earlier results for the same commit are kept, cases run again replace them
+    commit = commit_name()
+    results_file = os.path.join(args.output, 'results_'+commit+'.json')
+    results = {}
+    if os.path.exists(results_file):
+        with open(results_file) as fh:
+            results = json.load(fh)['results']
+
+    for size_name in args.sizes:
+
+        size = sizes[size_name]
+        data_path = os.path.abspath(os.path.join(args.output, 'data', size_name))
+        plot_path = os.path.abspath(os.path.join(args.output, 'plots', size_name))
+        os.makedirs(plot_path, exist_ok=True)
+        generate(data_path, size)
+
+        print("\n Timing size", size_name, "(median of", args.repeats, "runs)\n")
+        results.setdefault(size_name, {})
+
+        for case, (app_name, app_conf) in cases(data_path, plot_path, size).items():
+
+            if args.cases is not None and case not in args.cases:
+                continue
+
+            # A failing case is recorded and the remaining cases are still timed
+            try:
+                if app_name == 'raster':
+                    times = time_raster(data_path, plot_path, args.repeats)
+                else:
+                    times = time_application(app_name, app_conf, args.repeats)
+            except (Exception, SystemExit) as e:
+                results[size_name][case] = {'failed': str(e)}
+                print(" {:<22s} failed: {}".format(case, e))
+            else:
+                results[size_name][case] = {'median': statistics.median(times), 'times': times}
+                print(" {:<22s} {:10.3f} s".format(case, results[size_name][case]['median']))
+
+            # Save after each case so that an interrupted run keeps what was timed
+            save_results(results_file, commit, results)
+
+    print("\n Saved results as", results_file, "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import argparse
+import ast
+import importlib.util
+import statistics
+import subprocess
+import sys
+
+# --------------------------------------------------------------------------------------------------
+## @package startup
+#
+#  Measure the cost of getting an fv3jeditools application ready to run, i.e. everything the
+#  driver does before the application itself starts working.
+#
+#  Each measurement is made in a fresh interpreter so that nothing is already in sys.modules.
+#
+#  eager  | Import every application module and the libraries they used to import at module
+#         | level, which is what the package did before the application registry.
+#  import | Import the package and only the module of the requested application. This leaves out
+#         | the libraries the application imports when it runs.
+#  ready  | As import, followed by the libraries that the module imports inside its functions,
+#         | i.e. everything the application imports before it starts working. The speedup is
+#         | eager over ready.
+#
+#  Usage: python benchmarks/startup.py [-r repeats] [application ...]
+#
+# --------------------------------------------------------------------------------------------------
+
+# Libraries that were imported at module level by the applications
+eager_libraries = ['cartopy.crs', 'matplotlib', 'matplotlib.pyplot', 'matplotlib.ticker',
+                   'netCDF4', 'scipy.interpolate']
+
+eager_code = '''
+import importlib, time
+t0 = time.perf_counter()
+import fv3jeditools
+for library in {libraries}:
+    importlib.import_module(library)
+for module in fv3jeditools.application_modules.values():
+    importlib.import_module('fv3jeditools.'+module)
+fv3jeditools.get_application('{app_name}')
+print(time.perf_counter() - t0)
+'''
+
+lazy_code = '''
+import importlib, time
+t0 = time.perf_counter()
+import fv3jeditools
+fv3jeditools.get_application('{app_name}')
+for library in {libraries}:
+    importlib.import_module(library)
+print(time.perf_counter() - t0)
+'''
+
+# --------------------------------------------------------------------------------------------------
+
+def deferred_libraries(module_name):
+
+    # Modules imported inside the functions of a module, found from its source without importing it
+    source_file = importlib.util.find_spec(module_name).origin
+    with open(source_file) as fh:
+        tree = ast.parse(fh.read())
+
+    libraries = []
+    for function in ast.walk(tree):
+        if isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            for node in ast.walk(function):
+                if isinstance(node, ast.Import):
+                    libraries.extend(alias.name for alias in node.names)
+                elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                    libraries.append(node.module)
+
+    # Libraries that are not installed, e.g. the ioda converters used by gsidiag_to_ioda, are left
+    # out since the application could not run here anyway
+    def installed(library):
+        try:
+            return importlib.util.find_spec(library) is not None
+        except ImportError:
+            return False
+
+    return sorted(library for library in set(libraries) if installed(library))
+
+# --------------------------------------------------------------------------------------------------
+
+def time_startup(code, repeats):
+
+    # Run the snippet in new interpreters and return the median time
+    times = []
+    for n in range(repeats):
+        output = subprocess.run([sys.executable, '-c', code], check=True,
+                                stdout=subprocess.PIPE).stdout
+        times.append(float(output.decode('utf-8').split()[-1]))
+
+    return statistics.median(times)
+
+# --------------------------------------------------------------------------------------------------
+
+def main():
+
+    import fv3jeditools
+
+    sargs = argparse.ArgumentParser()
+    sargs.add_argument("-r", "--repeats", type=int, default=5)
+    sargs.add_argument("applications", nargs='*',
+                       default=sorted(fv3jeditools.application_modules.keys()))
+    args = sargs.parse_args()
+
+    print("\n fv3jeditools startup time (median of", args.repeats, "runs)\n")
+    print(" {:<22s} {:>10s} {:>10s} {:>10s} {:>8s}".format("application", "eager (s)",
+                                                           "import (s)", "ready (s)", "speedup"))
+
+    for app_name in args.applications:
+
+        libraries = deferred_libraries('fv3jeditools.'+fv3jeditools.application_modules[app_name])
+
+        eager = time_startup(eager_code.format(libraries=eager_libraries, app_name=app_name),
+                             args.repeats)
+        lazy = time_startup(lazy_code.format(app_name=app_name, libraries=[]), args.repeats)
+        ready = time_startup(lazy_code.format(app_name=app_name, libraries=libraries),
+                             args.repeats)
+
+        print(" {:<22s} {:>10.3f} {:>10.3f} {:>10.3f} {:>7.1f}x".format(app_name, eager, lazy,
+                                                                         ready, eager/ready))
+
+    print("\n")
+
+
+if __name__ == "__main__":
+    main()
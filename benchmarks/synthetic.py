@@ -0,0 +1,247 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import datetime as dt
+import netCDF4
+import numpy as np
+
+# --------------------------------------------------------------------------------------------------
+## @package synthetic
+#
+#  Generators of synthetic inputs for the benchmarks. Values are random but have realistic
+#  structure so that the applications exercise the same code paths as for real data.
+#
+#  write_ioda_hofx   | IODA hofx file(s) with MetaData, ObsValue, hofx, hofx0..N, GSI and QC groups
+#  write_oops_log    | OOPS log with minimizer iterations, ensemble block output and timing tables
+#  write_cube_fields | Cubed-sphere GFS tile files, e.g. fields.tile1.nc
+#  write_fv3grid     | fv3grid_cNNNN.nc4 grid file with the cell vertices used by raster.py
+#  write_latlon      | Fields on a lon/lat grid as written by fv3-jedi, used by field_plot
+#
+# --------------------------------------------------------------------------------------------------
+
+# Missing value used in IODA files
+missing = 9.96921e+36
+
+# --------------------------------------------------------------------------------------------------
+
+def write_ioda_hofx(path, nlocs, nchans=0, nouter=2, variable='brightness_temperature',
+                    window_begin=dt.datetime(2020, 1, 1, 21), window_hours=6,
+                    missing_fraction=0.02, seed=0):
+
+    # Write one IODA file of observations and their simulated equivalents. Channelled variables
+    # are written with shape (nlocs, nchans).
+
+    rng = np.random.default_rng(seed)
+
+    shape = (nlocs,) if nchans == 0 else (nlocs, nchans)
+    dims = ('nlocs',) if nchans == 0 else ('nlocs', 'nchans')
+
+    fh = netCDF4.Dataset(path, 'w')
+    fh.createDimension('nlocs', nlocs)
+    if nchans != 0:
+        fh.createDimension('nchans', nchans)
+        channels = fh.createVariable('nchans', 'i4', ('nchans',))
+        channels[:] = np.arange(1, nchans+1)
+
+    # Metadata
+    meta = fh.createGroup('MetaData')
+    lats = np.degrees(np.arcsin(rng.uniform(-1, 1, nlocs)))
+    meta.createVariable('latitude', 'f4', ('nlocs',))[:] = lats
+    meta.createVariable('longitude', 'f4', ('nlocs',))[:] = rng.uniform(-180, 180, nlocs)
+    seconds = np.sort(rng.uniform(0, window_hours*3600, nlocs)).astype('int64')
+    times = np.datetime64(window_begin) + seconds.astype('timedelta64[s]')
+    datetimes = meta.createVariable('datetime', str, ('nlocs',))
+    datetimes[:] = np.array([str(t)+'Z' for t in times.astype('datetime64[s]')], dtype='object')
+
+    # Observations with some missing values
+    obs = 250.0 + 20.0*rng.standard_normal(shape)
+    obs[rng.uniform(size=shape) < missing_fraction] = missing
+    valid = obs != missing
+
+    def write_group(group, values):
+        grp = fh.groups[group] if group in fh.groups else fh.createGroup(group)
+        values = np.where(valid, values, missing)
+        grp.createVariable(variable, 'f4', dims, fill_value=missing)[:] = values
+
+    write_group('ObsValue', obs)
+
+    # Simulated observations, the innovations shrink with each outer loop
+    for n in range(nouter+1):
+        write_group('hofx'+str(n), obs + (2.0/(n+1))*rng.standard_normal(shape))
+    write_group('hofx', obs + (2.0/(nouter+1))*rng.standard_normal(shape))
+    write_group('GsiHofX', obs + 1.5*rng.standard_normal(shape))
+    write_group('GsiHofXBc', obs + 1.0*rng.standard_normal(shape))
+
+    # Quality control flags, mostly assimilated
+    for group in ['PreQC', 'EffectiveQC']:
+        grp = fh.createGroup(group)
+        qc = np.where(rng.uniform(size=shape) < 0.8, 0, rng.integers(1, 12, shape))
+        grp.createVariable(variable, 'i4', dims)[:] = np.where(valid, qc, 10)
+
+    fh.close()
+
+# --------------------------------------------------------------------------------------------------
+
+def write_ioda_hofx_files(path_template, nfiles, nlocs, **kwargs):
+
+    # Split nlocs over nfiles files as written by a multi-task run. The template contains {} for
+    # the task number. Returns the list of files.
+
+    files = []
+    counts = np.full(nfiles, nlocs//nfiles)
+    counts[0:nlocs % nfiles] += 1
+    for n, count in enumerate(counts):
+        files.append(path_template.format(str(n).zfill(4)))
+        write_ioda_hofx(files[-1], int(count), seed=n, **kwargs)
+
+    return files
+
+# --------------------------------------------------------------------------------------------------
+
+def write_oops_log(path, niter=25, nouter=2, minimizer='DRIPCG', members=0, ntimers=60,
+                   nfiller=0, seed=0):
+
+    # Write an OOPS log containing:
+    #  - nouter outer loops of niter iterations of the minimizer, as read by da_convergence
+    #  - per member norm reduction and cost function (J, Jb and JoJc) lines when members > 0, of
+    #    which da_block_convergence reads the norm reduction and J
+    #  - the serial and parallel timing tables, as read by log_timing
+    #  - nfiller lines of other output between each iteration to give the log a realistic size
+
+    rng = np.random.default_rng(seed)
+
+    filler = "Info     : ObsSpace::ObsSpace: observation vector {} of window has {} locations\n"
+
+    with open(path, 'w') as fh:
+
+        fh.write("OOPS Starting 2020-01-01T00:00:00Z\n")
+        fh.write("Minimizer algorithm="+minimizer+"\n")
+
+        for outer in range(nouter):
+            fh.write("Variational: running outer loop "+str(outer+1)+"\n")
+            for i in range(1, niter+1):
+
+                for n in range(nfiller):
+                    fh.write(filler.format(n, rng.integers(1000, 100000)))
+
+                grad = 0.9**i
+                cost = 1.0e5*0.8**i + 1.0e4
+                fh.write(minimizer+" end of iteration "+str(i)+"\n")
+                fh.write("  Gradient reduction ("+str(i)+") = "+str(grad)+"\n")
+                fh.write("  Norm reduction ("+str(i)+") = "+str(grad*0.95)+"\n")
+                fh.write("\n")
+                fh.write("  Quadratic cost function: J   ("+str(i)+") = "+str(cost)+"\n")
+                fh.write("  Quadratic cost function: Jb  ("+str(i)+") = "+str(0.1*cost)+"\n")
+                fh.write("  Quadratic cost function: JoJc("+str(i)+") = "+str(0.9*cost)+"\n")
+
+                if members > 0:
+                    norms = grad*rng.uniform(0.8, 1.2, members)
+                    costs = cost*rng.uniform(0.8, 1.2, members)
+                    fh.write("   Norm reduction all members ("+str(i)+") = " +
+                             ", ".join('{:.6e}'.format(v) for v in norms)+"\n")
+                    fh.write("   Quadratic cost function all members: J ("+str(i)+") = " +
+                             ", ".join('{:.6e}'.format(v) for v in costs)+"\n")
+                    fh.write("   Quadratic cost function all members: Jb ("+str(i)+") = " +
+                             ", ".join('{:.6e}'.format(0.1*v) for v in costs)+"\n")
+                    fh.write("   Quadratic cost function all members: JoJc ("+str(i)+") = " +
+                             ", ".join('{:.6e}'.format(0.9*v) for v in costs)+"\n")
+
+        # Timing tables. Columns after the colon are total (ms), count, percentage of total and
+        # time per call (ms). The first two and last rows are the run and total timers.
+        names = ['oops::Run::Run', 'oops::Run::execute'] + \
+                ['oops::Method'+str(n).zfill(3)+'::apply' for n in range(ntimers)] + \
+                ['oops::Total']
+        totals = rng.lognormal(6.0, 2.0, len(names))
+        counts = rng.integers(1, 1000, len(names))
+        grand_total = np.sum(totals)
+
+        fh.write("OOPS_STATS " + "-"*100 + "\n")
+        fh.write("OOPS_STATS " + "-"*40 + " Timing Statistics " + "-"*41 + "\n")
+        for name, total, count in zip(names, totals, counts):
+            fh.write("OOPS_STATS {:<60s}: {:14.2f} {:10d} {:8.2f} {:14.2f}\n".format(
+                     name, total, count, 100.0*total/grand_total, total/count))
+        fh.write("OOPS_STATS " + "-"*40 + " Timing Statistics " + "-"*41 + "\n")
+
+        fh.write("OOPS_STATS " + "-"*35 + " Parallel Timing Statistics " + "-"*37 + "\n")
+        for name, total in zip(names, totals):
+            fh.write("OOPS_STATS {:<60s}: {:14.2f} {:14.2f} {:14.2f} {:8.2f}\n".format(
+                     name, 0.9*total, 1.1*total, total, 10.0))
+        fh.write("OOPS_STATS oops::Parallel::Total"+" "*41+": {:14.2f}\n".format(grand_total))
+        fh.write("OOPS_STATS " + "-"*35 + " Parallel Timing Statistics " + "-"*37 + "\n")
+
+        fh.write("OOPS Ending 2020-01-01T00:10:00Z\n")
+
+# --------------------------------------------------------------------------------------------------
+
+def write_fv3grid(path, npx):
+
+    # Cell vertex longitudes and latitudes (radians) of a gnomonic cubed-sphere with npx cells
+    # along each edge of a tile.
+
+    a = np.tan(np.linspace(-np.pi/4, np.pi/4, npx+1))
+    x, y = np.meshgrid(a, a)
+    one = np.ones_like(x)
+
+    # Cartesian coordinates of the six faces
+    faces = [( one,    x,    y), (  -x,  one,    y), (-one,   -x,    y),
+             (   x, -one,    y), (  -y,    x,  one), (   y,    x, -one)]
+
+    vlons = np.empty((6, npx+1, npx+1))
+    vlats = np.empty((6, npx+1, npx+1))
+    for n, (cx, cy, cz) in enumerate(faces):
+        norm = np.sqrt(cx**2 + cy**2 + cz**2)
+        vlons[n] = np.arctan2(cy, cx)
+        vlats[n] = np.arcsin(cz/norm)
+
+    fh = netCDF4.Dataset(path, 'w')
+    fh.createDimension('ntiles', 6)
+    fh.createDimension('nvy', npx+1)
+    fh.createDimension('nvx', npx+1)
+    fh.createVariable('vlons', 'f8', ('ntiles', 'nvy', 'nvx'))[:] = vlons
+    fh.createVariable('vlats', 'f8', ('ntiles', 'nvy', 'nvx'))[:] = vlats
+    fh.close()
+
+# --------------------------------------------------------------------------------------------------
+
+def write_cube_fields(path, npx, npz, variable='T', seed=0):
+
+    # Write GFS style tile files path.tileN.nc with variable of shape (1, npz, npx, npx)
+
+    rng = np.random.default_rng(seed)
+
+    for tile in range(1, 7):
+        fh = netCDF4.Dataset(path.replace('.nc', '.tile'+str(tile)+'.nc'), 'w')
+        fh.createDimension('Time', 1)
+        fh.createDimension('zaxis_1', npz)
+        fh.createDimension('yaxis_1', npx)
+        fh.createDimension('xaxis_1', npx)
+        var = fh.createVariable(variable, 'f4', ('Time', 'zaxis_1', 'yaxis_1', 'xaxis_1'))
+        var.units = 'K'
+        var.long_name = 'air_temperature'
+        var[:] = 250.0 + 10.0*rng.standard_normal((1, npz, npx, npx))
+        fh.close()
+
+# --------------------------------------------------------------------------------------------------
+
+def write_latlon(path, nlon, nlat, npz, fields=['t'], seed=0):
+
+    # Write fields on a lon/lat grid with shape (1, npz, nlat, nlon)
+
+    rng = np.random.default_rng(seed)
+
+    fh = netCDF4.Dataset(path, 'w')
+    fh.createDimension('time', 1)
+    fh.createDimension('lev', npz)
+    fh.createDimension('lat', nlat)
+    fh.createDimension('lon', nlon)
+    fh.createVariable('lons', 'f8', ('lon',))[:] = np.linspace(-180, 180, nlon, endpoint=False)
+    fh.createVariable('lats', 'f8', ('lat',))[:] = np.linspace(-90, 90, nlat)
+    for field in fields:
+        var = fh.createVariable(field, 'f4', ('time', 'lev', 'lat', 'lon'))
+        var.units = 'K'
+        var[:] = rng.standard_normal((1, npz, nlat, nlon))
+    fh.close()
+
+# --------------------------------------------------------------------------------------------------
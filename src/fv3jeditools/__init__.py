@@ -1,18 +1,61 @@
 # -*- coding: utf-8 -*-
 __path__ = __import__('pkgutil').extend_path(__path__, __name__)
 
-from .diag_da_block_convergence import *
-from .diag_da_convergence import *
-from .diag_field_plot import *
-from .diag_hofx_innovations import *
-from .diag_hofx_map import *
-from .diag_log_timing import *
-from .diag_obs_scatter import *
-from .gsidiag_to_ioda import *
-from .parse_file_datetime import *
-from .remove import *
-from .stage_files import *
-from .tar import *
-from .untar import *
+import importlib
+
+from . import utils
 from .utils import *
 from .utils_datetime import *
+
+# --------------------------------------------------------------------------------------------------
+
+# Registry of applications. Maps the 'application name' used in the driver yaml to the module that
+# provides it. Modules are only imported when the application is requested so that light weight
+# applications do not pay for the import of plotting and netCDF libraries.
+application_modules = {
+    'da_block_convergence': 'diag_da_block_convergence',
+    'da_convergence': 'diag_da_convergence',
+    'field_plot': 'diag_field_plot',
+    'hofx_innovations': 'diag_hofx_innovations',
+    'hofx_map': 'diag_hofx_map',
+    'log_timing': 'diag_log_timing',
+    'obs_scatter': 'diag_obs_scatter',
+    'gsidiag_to_ioda': 'gsidiag_to_ioda',
+    'parse_file_datetime': 'parse_file_datetime',
+    'remove': 'remove',
+    'stage_files': 'stage_files',
+    'tar': 'tar',
+    'untar': 'untar',
+}
+
+# --------------------------------------------------------------------------------------------------
+
+def get_application(app_name):
+
+    # Look up the module providing the application
+    try:
+        module_name = application_modules[app_name]
+    except KeyError:
+        utils.abort('\''+app_name+'\' is not a known fv3jeditools application')
+
+    # Import only that module
+    module = importlib.import_module('.'+module_name, __name__)
+    application = getattr(module, app_name)
+
+    # Importing the module binds the module to the package name, e.g. fv3jeditools.tar. Rebind to
+    # the application function as the former star imports did.
+    globals()[app_name] = application
+
+    return application
+
+# --------------------------------------------------------------------------------------------------
+
+def __getattr__(name):
+
+    # Allow fv3jeditools.<application name> for callers that used the eager imports
+    if name in application_modules:
+        return get_application(name)
+
+    raise AttributeError("module '"+__name__+"' has no attribute '"+name+"'")
+
+# --------------------------------------------------------------------------------------------------
@@ -3,12 +3,12 @@
 # This software is licensed under the terms of the Apache Licence Version 2.0
 # which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
 
-import matplotlib.pyplot as plt
 import numpy as np
 import os
-import re
 
 import fv3jeditools.utils as utils
+import fv3jeditools.utils_log as utils_log
+import fv3jeditools.utils_profile as utils_profile
 
 # --------------------------------------------------------------------------------------------------
 ## @package da_block_convergence
@@ -17,9 +17,12 @@ import fv3jeditools.utils as utils
 #
 #  Configuration options:
 #  ----------------------
-#  log file    | The log file to parse the statistics from
+#  log file    | The log file to parse the statistics from, may be compressed (.gz, .bz2 or .xz)
+#  log archive | Tar archive holding the log, log file is then the name of the log in it
 #  yscale      | Whether to use log or linear scale for the yaxis
 #  plot format | The extension used for the file name, png or pdf
+#  log cache   | Keep the parsed log for later runs in <log file>.series.json (true), in a
+#              | directory (path) or not at all ([false])
 #
 #
 #  This function takes a yaml file configuration as well as a datetime. It will plot the convergence
@@ -31,6 +34,9 @@ import fv3jeditools.utils as utils
 
 def da_block_convergence(datetime, conf):
 
+    # Import matplotlib here so it is only loaded when the application runs
+    import matplotlib.pyplot as plt
+
     # Log file to parse
     try:
         log_file = conf['log file']
@@ -49,6 +55,15 @@ def da_block_convergence(datetime, conf):
     except:
         output_path = './'
 
+    # Cache of the parsed log
+    log_cache = utils.configGet(conf, 'log cache', False)
+
+    # Tar archive holding the log
+    try:
+        log_archive = conf['log archive']
+    except:
+        log_archive = None
+
     # Create output path
     if not os.path.exists(output_path):
         os.makedirs(output_path)
@@ -56,63 +71,37 @@ def da_block_convergence(datetime, conf):
     # Replace datetime in logfile name
     isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
     log_file = utils.stringReplaceDatetimeTemplate(isodatestr, log_file)
+    if log_archive is not None:
+        log_archive = utils.stringReplaceDatetimeTemplate(isodatestr, log_archive)
 
 
     # Read file and gather norm information
     print(" Reading convergence from ", log_file)
 
-    # Open the file ready for reading
-    if os.path.exists(log_file):
-        file = open(log_file, "r")
-    else:
-        utils.abort('Log file not found.')
-
-
-    # Search for the type of minimizer used for the assimilation
-    for line in file:
-        if "Minimizer algorithm=" in line:
-            minimizer = line.split('=')[1].rstrip()
-            break
+    # Parse the log in one pass
+    utils_profile.phase('read')
+    series = utils_log.read_log(log_file, log_cache, log_archive)
 
+    # Type of minimizer used for the assimilation
+    minimizer = series['minimizer']
+    if minimizer is None:
+        utils.abort('Minimizer algorithm not found in the log file.')
 
-    # Patterns to search for from the file
-    search_patterns = []
-    search_patterns.append("   Norm reduction all members .")
-    search_patterns.append("   Quadratic cost function all members: J .") 
+    # Values to plot, the last members values of each line
+    search_patterns = ['Norm reduction', 'J']
 
     # Labels for the figures
     ylabels = []
     ylabels.append(minimizer+" normalized gradient reduction")
     ylabels.append("Quadratic cost function J   ")
 
-    # Get all lines that match the search patterns
-    matches = []
-    for line in file:
-        for search_pattern in search_patterns:
-            reg = re.compile(search_pattern) 
-            if bool(re.match(reg, line.rstrip())):
-                matches.append(line.rstrip())
-
-    # Close the file
-    file.close()
- 
-    # Loop over stats to be searched on
-    maxiterations = 10000
-    count = np.zeros(len(search_patterns), dtype=int)
-    stats = np.zeros((members, len(search_patterns), maxiterations))
-    for search_pattern in search_patterns:
-
-        index = [i for i, s in enumerate(search_patterns) if search_pattern in s]
-
-        # Loop over the matches and fill stats
-        for match in matches:
-            reg = re.compile(search_pattern) 
-            if bool(re.match(reg, match)):
-                x = match.split()[-members:]
-                x2 = [sub.replace(',' , '') for sub in x]
-                for member in range(members):
-                    stats[member,index,count[index]]=x2[member]
-                count[index] = count[index] + 1
+    # Fill stats with the values of each member for each iteration
+    utils_profile.phase('compute')
+    count = np.array([len(series['members'][name]) for name in search_patterns])
+    stats = np.zeros((members, len(search_patterns), max(np.max(count), 1)))
+    for index, name in enumerate(search_patterns):
+        for iteration, values in enumerate(series['members'][name]):
+            stats[:,index,iteration] = values[-members:]
 
 
     niter = count[0]
@@ -121,6 +110,7 @@ def da_block_convergence(datetime, conf):
 
     # Create figures
     # --------------
+    utils_profile.phase('config parse')
 
     # Scale for y-axis
     try:
@@ -141,6 +131,7 @@ def da_block_convergence(datetime, conf):
         savename = savename.replace(" ", "-")
         savename = savename+"_"+datetime.strftime("%Y%m%d_%H%M%S")+"."+plotformat
         savename = os.path.join(output_path,savename)
+        utils_profile.phase('render')
         fig, ax = plt.subplots(figsize=(15, 7.5))
         for member in range(members):
             stat[member,0:niter] = stats[member,index,0:niter]
@@ -154,6 +145,7 @@ def da_block_convergence(datetime, conf):
         plt.ylabel(ylabel)
         plt.yscale(yscale)
 
+        utils_profile.phase('save')
         print(" Saving figure as", savename, "\n")
         plt.savefig(savename)
 
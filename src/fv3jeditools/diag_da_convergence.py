@@ -3,12 +3,14 @@
 # This software is licensed under the terms of the Apache Licence Version 2.0
 # which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
 
-import matplotlib.pyplot as plt
+import json
 import numpy as np
 import os
-import re
+import time
 
 import fv3jeditools.utils as utils
+import fv3jeditools.utils_log as utils_log
+import fv3jeditools.utils_profile as utils_profile
 
 # --------------------------------------------------------------------------------------------------
 ## @package da_convergence
@@ -17,9 +19,20 @@ import fv3jeditools.utils as utils
 #
 #  Configuration options:
 #  ----------------------
-#  log file    | The log file to parse the statistics from
-#  yscale      | Whether to use log or linear scale for the yaxis
-#  plot format | The extension used for the file name, png or pdf
+#  log file        | The log file to parse the statistics from, may be compressed (.gz, .bz2 or
+#                  | .xz)
+#  log archive     | Tar archive holding the log, log file is then the name of the log in it
+#  yscale          | Whether to use log or linear scale for the yaxis
+#  plot format     | The extension used for the file name, png or pdf
+#  log cache       | Keep the parsed log for later runs in <log file>.series.json (true), in a
+#                  | directory (path) or not at all ([false])
+#  follow          | Follow the log of a running job (true or [false]). The new lines of the log are
+#                  | parsed every follow interval and the figures and a JSON file of the series,
+#                  | convergence_<datetime>.json, are updated when there are new values and once
+#                  | more when following stops, when the run ends or the log has not grown for
+#                  | follow timeout
+#  follow interval | Seconds between updates when following the log [30]
+#  follow timeout  | Seconds without the log growing after which following stops [3600]
 #
 #
 #  This function takes a yaml file configuration as well as a datetime. It will plot the convergence
@@ -55,6 +68,20 @@ def da_convergence(datetime, conf):
     except:
         plotformat = 'png'
 
+    # Cache of the parsed log
+    log_cache = utils.configGet(conf, 'log cache', False)
+
+    # Tar archive holding the log
+    try:
+        log_archive = conf['log archive']
+    except:
+        log_archive = None
+
+    # Follow the log of a running job
+    follow = utils.configGet(conf, 'follow', False)
+    follow_interval = utils.configGet(conf, 'follow interval', 30)
+    follow_timeout = utils.configGet(conf, 'follow timeout', 3600)
+
     # Create output path
     if not os.path.exists(output_path):
         os.makedirs(output_path)
@@ -62,50 +89,84 @@ def da_convergence(datetime, conf):
     # Replace datetime in logfile name
     isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
     log_file = utils.stringReplaceDatetimeTemplate(isodatestr, log_file)
+    if log_archive is not None:
+        log_archive = utils.stringReplaceDatetimeTemplate(isodatestr, log_archive)
 
 
     # Read file and gather norm information
     print(" Reading convergence from ", log_file)
 
 
-    # Check the file exists
-    if not os.path.exists(log_file):
-        utils.abort('Log file not found.')
+    # Parse the whole log in one pass
+    if not follow:
+        utils_profile.phase('read')
+        series = utils_log.read_log(log_file, log_cache, log_archive)
+        plot_convergence(series, datetime, output_path, yscale, plotformat)
+        return
+
+    # Follow the log, parsing only what was added since the last update
+    if log_archive is not None or log_file.endswith(tuple(utils_log.compressed_log_openers)):
+        utils.abort('da_convergence: follow needs a log that is not compressed or archived')
+    print(" Following ", log_file, " every ", follow_interval, " seconds")
+    follow_state = utils_log.log_follow_init()
+    json_file = os.path.join(output_path,
+                             "convergence_"+datetime.strftime("%Y%m%d_%H%M%S")+".json")
+    last_growth = time.time()
+    while True:
+
+        utils_profile.phase('read')
+        nbytes, nrecords = utils_log.log_follow_update(log_file, follow_state)
+        if nbytes > 0:
+            last_growth = time.time()
+
+        if follow_state['finished']:
+            print(" End of run found in the log, no longer following")
+            break
+        if time.time() - last_growth > follow_timeout:
+            print(" Log has not grown for ", follow_timeout, " seconds, no longer following")
+            break
+
+        if nrecords > 0:
+            print(" Found ", nrecords, " new values")
+            plot_convergence(follow_state['series'], datetime, output_path, yscale, plotformat)
+            save_series(follow_state['series'], json_file)
+
+        time.sleep(follow_interval)
+
+    # Final figures and series, including anything read by the last update
+    plot_convergence(follow_state['series'], datetime, output_path, yscale, plotformat)
+    save_series(follow_state['series'], json_file)
+
+# --------------------------------------------------------------------------------------------------
+
+def save_series(series, json_file):
+
+    # Iteration series so far, written whole so that a reader never sees a partial file
+    utils_profile.phase('save')
+    with open(json_file+'.tmp', 'w') as fh:
+        json.dump(series['iterations'], fh)
+    os.replace(json_file+'.tmp', json_file)
 
-    # Convert file to list
-    lines = []
-    with open(log_file) as file:
-        for line in file:
-            lines.append(line)
+# --------------------------------------------------------------------------------------------------
+
+def plot_convergence(series, datetime, output_path, yscale, plotformat):
 
-    # Get unique minizers used in run, e.g. DRIPCG + GMRES
-    minimizers = []
-    for line in lines:
-        if " end of iteration " in line:
-            minimizers.append(line.split()[0])
-    minimizers=set(minimizers) # Unique only
+    # Import matplotlib here so it is only loaded when the application runs
+    import matplotlib.pyplot as plt
 
+    isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
 
-    # Loop over minimizers
-    for minimizer in minimizers:
+    # Loop over minimizers used in run, e.g. DRIPCG + GMRES
+    utils_profile.phase('compute')
+    for minimizer, values in series['iterations'].items():
 
         print('Processing ', minimizer)
 
-        grad_red  = []
-        norm_red  = []
-        quad_j    = []
-        quad_jb   = []
-        quad_JoJc = []
-        for num, line in enumerate(lines, 1):
-            if minimizer+" end of iteration " in line:
-                grad_red.append(lines[num].split()[-1])
-                norm_red.append(lines[num+1].split()[-1])
-                if (lines[num+3].split()[0] == 'Quadratic'):
-                    quad_j.append(lines[num+3].split()[-1])
-                if (lines[num+3].split()[0] == 'Quadratic'):
-                    quad_jb.append(lines[num+4].split()[-1])
-                if (lines[num+3].split()[0] == 'Quadratic'):
-                    quad_JoJc.append(lines[num+5].split()[-1])
+        grad_red  = values['Gradient reduction']
+        norm_red  = values['Norm reduction']
+        quad_j    = values['J']
+        quad_jb   = values['Jb']
+        quad_JoJc = values['JoJc']
 
 
         # Loop over metrics
@@ -143,6 +204,7 @@ def da_convergence(datetime, conf):
                 savename = savename+"_"+datetime.strftime("%Y%m%d_%H%M%S")+"."+plotformat
                 savename = os.path.join(output_path,savename)
 
+                utils_profile.phase('render')
                 fig, ax = plt.subplots(figsize=(15, 7.5))
                 ax.plot(iter, stat_plot, linestyle='-', marker='x')
                 ax.tick_params(labelbottom=True, labeltop=False, labelleft=True, labelright=True)
@@ -151,8 +213,10 @@ def da_convergence(datetime, conf):
                 plt.ylabel(ylabel)
                 plt.yscale(yscale)
                 plt.xlim([0.9, niter+0.1])
+                utils_profile.phase('save')
                 print(" Saving figure as", savename, "\n")
                 plt.savefig(savename)
+                plt.close(fig)
 
 
 # --------------------------------------------------------------------------------------------------
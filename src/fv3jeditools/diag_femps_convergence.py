@@ -6,18 +6,52 @@
 # which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
 
 import argparse
+import bz2
+import contextlib
+import gzip
+import io
+import lzma
 import matplotlib.pyplot as plt
 import matplotlib
 import numpy as np
 import os
+import tarfile
 
 matplotlib.use("Agg")
 
+# Openers of compressed files by extension. The script runs on its own so it does not use
+# fv3jeditools.utils_log, which holds the same for the log diagnostics.
+compressed_openers = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
 
 def lines_that_contain(string, fh):
     return [line for line in fh if string in line]
 
 
+@contextlib.contextmanager
+def open_text(file, archive=None):
+
+    # Lines of a file that may be compressed and may be a member of a tar archive, decompressed
+    # while they are read
+    with contextlib.ExitStack() as stack:
+        if archive is None:
+            fh = stack.enter_context(open(file, 'rb'))
+        else:
+            tar = stack.enter_context(tarfile.open(archive, 'r:*'))
+            try:
+                fh = tar.extractfile(file)
+            except KeyError:
+                fh = None
+            if fh is None:
+                print("ABORT: "+file+" is not a file in "+archive)
+                exit()
+            stack.enter_context(fh)
+        opener = compressed_openers.get(os.path.splitext(file)[1], None)
+        if opener is not None:
+            fh = stack.enter_context(opener(fh))
+        yield io.TextIOWrapper(fh, encoding='utf-8', errors='replace')
+
+
 def main():
 
     # User input
@@ -27,6 +61,7 @@ def main():
     sargs.add_argument("-p", "--plot_level", default='50')
     sargs.add_argument("-f", "--field",      default='psi')
     sargs.add_argument("-l", "--log_file",   default='femps_rmse.txt')
+    sargs.add_argument("-a", "--archive",    default=None)
 
     args = sargs.parse_args()
 
@@ -46,6 +81,8 @@ def main():
     print(" - Level to plot "+levelstr)
     print(" - Field to plot: "+field)
     print(" - File to read: "+log_file)
+    if args.archive is not None:
+        print(" - Tar archive holding the file: "+args.archive)
     print("\n")
 
     level = float(levelstr)-1
@@ -53,8 +90,9 @@ def main():
     # Search log for matching string
 
     convergence_all = []
-    # Open and get lines that match
-    with open(log_file, 'r') as fh:
+    # Open and get lines that match, compressed (.gz, .bz2 or .xz) and archived files are read
+    # while they are decompressed
+    with open_text(log_file, args.archive) as fh:
         for line in lines_that_contain("INVERSELAP RMSE:", fh):
             convergence_all.append(line)
 
@@ -85,7 +123,10 @@ def main():
     rmse_array = np.empty((niter))
     rmse_array[:] = convergence_var[:, ind_rmse]
 
-    figfile = 'fempsconv-'+os.path.splitext(os.path.split(log_file)[1])[0]+'-level'+levelstr.zfill(2)+'-'+field+'.png'
+    log_name = os.path.split(log_file)[1]
+    if log_name.endswith(tuple(compressed_openers)):
+        log_name = os.path.splitext(log_name)[0]
+    figfile = 'fempsconv-'+os.path.splitext(log_name)[0]+'-level'+levelstr.zfill(2)+'-'+field+'.png'
 
     plt.figure(figsize=(15, 7.5))
     plt.plot(iter_array, rmse_array, linestyle='-', marker='x')
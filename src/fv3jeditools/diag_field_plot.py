@@ -3,13 +3,11 @@
 # This software is licensed under the terms of the Apache Licence Version 2.0
 # which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
 
-import cartopy.crs as ccrs
-import matplotlib.pyplot as plt
-import netCDF4
 import numpy as np
 import os
 
 import fv3jeditools.utils as utils
+import fv3jeditools.utils_profile as utils_profile
 
 # --------------------------------------------------------------------------------------------------
 ## @package field_plot
@@ -30,6 +28,11 @@ import fv3jeditools.utils as utils
 
 def field_plot(datetime, conf):
 
+    # Import plotting and netCDF libraries here so they are only loaded when the application runs
+    import cartopy.crs as ccrs
+    import matplotlib.pyplot as plt
+    import netCDF4
+
     # File containing field to plot
     try:
         fields_file = conf['fields file']
@@ -63,6 +66,7 @@ def field_plot(datetime, conf):
         os.makedirs(output_path)
 
     # Open the file
+    utils_profile.phase('read')
     print('\nOpening ', fields_file, 'for reading')
     ncfile = netCDF4.Dataset(fields_file, mode='r')
 
@@ -81,6 +85,8 @@ def field_plot(datetime, conf):
 
     for field_name in field_names:
 
+        utils_profile.phase('read')
+
         # Get field units from the file
         units = ncfile.variables[field_name].units
 
@@ -112,6 +118,7 @@ def field_plot(datetime, conf):
 
         # Check if field has positve and negative values
         # ----------------------------------------------
+        utils_profile.phase('compute')
         if np.min(field) < 0:
           cmax = np.max(np.abs(field))
           cmin = -cmax
@@ -125,6 +132,7 @@ def field_plot(datetime, conf):
 
         # Create two dimensional contour plot of field
         # --------------------------------------------
+        utils_profile.phase('render')
 
         # Set the projection
         projection = ccrs.PlateCarree()
@@ -156,6 +164,7 @@ def field_plot(datetime, conf):
         fig.colorbar(im)
 
         # Save the figure
+        utils_profile.phase('save')
         print(" Saving figure as", outfile, "\n")
         plt.savefig(outfile)
 
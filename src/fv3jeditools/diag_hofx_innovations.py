@@ -3,18 +3,15 @@
 # This software is licensed under the terms of the Apache Licence Version 2.0
 # which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
 
-import cartopy.crs as ccrs
 import datetime as dt
 import glob
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
-import netCDF4
+import itertools
 import numpy as np
 import os
-import scipy.interpolate
 
 import fv3jeditools.utils as utils
+import fv3jeditools.utils_profile as utils_profile
+import fv3jeditools.utils_stats as utils_stats
 
 # --------------------------------------------------------------------------------------------------
 ## @package hofx_innovations
@@ -31,13 +28,30 @@ import fv3jeditools.utils as utils
 #  offset option described below can be used.
 #
 #  hofx files            | File(s) to parse. E.g. aircraft_hofx_%Y%m%d%H.nc4
-#  variable              | Variable to plot (either something from the file or variable@omb)
+#  field                 | Variable(s) to plot, one, a list or all. Files are read once for all
+#  channel               | Channel(s) to plot for files with channels, one, a list or all
 #  number of outer loops | Number of outer loops used in the assimilation
 #  number of bins        | Number of bins to use in histogram of the data
 #  units                 | Units of the field being plotted
 #  window length         | Window length (hours)
 #  time offset           | Offset of time in filename from window center (hours), e.g. -3, +3 or 0
 #  plot format           | Output format for plots ([png] or pdf)
+#  read workers          | Number of processes reading the hofx files in parallel [4]
+#  histogram range       | Fixed [minimum, maximum] of the histograms. Without it the range is
+#                        | that of the data and histograms of different cycles cannot be summed
+#  save histogram        | Save the histograms and statistics of the cycle to a .npz file next
+#                        | to the figure (true or [false])
+#  histogram files       | Instead of reading hofx files sum the histograms saved by earlier
+#                        | runs, e.g. over a month of cycles. E.g. out/*_innovations_%Y%m*.npz
+#  smoothing             | Curve drawn through the histograms, [spline] or kde for a Gaussian
+#                        | kernel density estimate
+#  kde bandwidth         | Bandwidth of the kernel in units of the field [Silverman's rule]
+#  time range            | Only use observations between [first, last] hours from the start of
+#                        | the window, e.g. [0, 3], using MetaData datetime
+#  sub window length     | Length (hours) of sub windows that each get a figure and histogram
+#  qc filter             | Only use observations with accepted flags in this QC group, e.g.
+#                        | EffectiveQC
+#  qc accepted           | QC flags of the observations that are used, one or a list [0]
 #
 #
 #  This function can be used to plot innovation statistics for the variational assimilation output.
@@ -46,28 +60,31 @@ import fv3jeditools.utils as utils
 
 def hofx_innovations(datetime, conf):
 
-
     # Parse configuration
     # -------------------
 
-    # File containing hofx files
-    hofx_files_template = utils.configGetOrFail(conf, 'hofx files')
+    # Histograms saved by earlier runs to sum instead of reading hofx files
+    try:
+        histogram_files_template = conf['histogram files']
+    except:
+        histogram_files_template = None
 
+    if histogram_files_template is None:
 
-    # Get variable to plot
-    variable = utils.configGetOrFail(conf, 'field')
+        # File containing hofx files
+        hofx_files_template = utils.configGetOrFail(conf, 'hofx files')
 
 
-    # Get number of outer loops used in the assimilation
-    nouter = utils.configGetOrFail(conf, 'number of outer loops')
+        # Get number of outer loops used in the assimilation
+        nouter = utils.configGetOrFail(conf, 'number of outer loops')
 
 
-    # Get window length
-    window_length = dt.timedelta(hours=int(utils.configGetOrFail(conf, 'window length')))
+        # Get window length
+        window_length = dt.timedelta(hours=int(utils.configGetOrFail(conf, 'window length')))
 
 
-    # Get time offset from center of window
-    time_offset = dt.timedelta(hours=int(utils.configGetOrFail(conf, 'time offset')))
+        # Get time offset from center of window
+        time_offset = dt.timedelta(hours=int(utils.configGetOrFail(conf, 'time offset')))
 
 
     # Get units of variable being plotted
@@ -88,6 +105,30 @@ def hofx_innovations(datetime, conf):
     except:
         nbins = 1000
 
+    # Number of processes reading the files
+    read_workers = utils.configGet(conf, 'read workers', 4)
+
+    # Fixed range of the histograms, needed for the histograms to be summed across cycles
+    try:
+        histogram_range = conf['histogram range']
+    except:
+        histogram_range = None
+
+    # Observations used according to their QC flags
+    qc_filter = utils.configQCFilter(conf)
+
+    # Save the histogram of this cycle for summing later
+    save_histogram = utils.configGet(conf, 'save histogram', False)
+
+    # Curve drawn through the histograms
+    smoothing = utils.configGet(conf, 'smoothing', 'spline')
+    if smoothing not in ['spline', 'kde']:
+        utils.abort('hofx_innovations: smoothing must be spline or kde')
+    try:
+        kde_bandwidth = conf['kde bandwidth']
+    except:
+        kde_bandwidth = None
+
     # Get output path for plots
     try:
         output_path = conf['output path']
@@ -98,130 +139,276 @@ def hofx_innovations(datetime, conf):
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
-    # Get list of hofx files to read
-    # ------------------------------
-
-    # Replace datetime in logfile name
-    isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
-    hofx_files_template = utils.stringReplaceDatetimeTemplate(isodatestr, hofx_files_template)
-
-    hofx_files = glob.glob(hofx_files_template)
-
-    if hofx_files==[]:
-        utils.abort("No hofx files matching the input string")
-
-
-    # Variable name and units
-    # -----------------------
-    varname = variable
+    # Metric being plotted
+    # --------------------
     vmetric = 'innovations'
 
+    # Histograms, statistics and window of each figure
+    plots = []
 
-    # Compute window begin time
-    # -------------------------
-    window_begin = datetime + time_offset - window_length/2
+    if histogram_files_template is None:
 
+        # Get list of hofx files to read
+        # ------------------------------
+        utils_profile.phase('file discovery')
 
-    # Loop over data files and read
-    # -----------------------------
-    nlocs = 0
-    print(" Reading all files to get global nlocs")
-    for hofx_file in hofx_files:
+        # Replace datetime in logfile name
+        isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
+        hofx_files_template = utils.stringReplaceDatetimeTemplate(isodatestr, hofx_files_template)
 
-        # Open the file
-        fh = netCDF4.Dataset(hofx_file)
-        nlocs = nlocs + fh.dimensions['nlocs'].size
-        fh.close()
+        hofx_files = sorted(glob.glob(hofx_files_template))
 
-    print(" Number of locations for this platform: ", nlocs)
+        if hofx_files==[]:
+            utils.abort("No hofx files matching the input string")
 
-    # Array to hold hofx data
-    obs = np.zeros((nlocs))
-    hofx = np.zeros((nlocs, nouter+1))
 
-    # Missing values
-    missing = 9.0e+30
+        # Compute window begin time
+        # -------------------------
+        window_begin = datetime + time_offset - window_length/2
+        window_end = window_begin + window_length
 
-    # Loop over files and read h(x) files
-    nlocs_start = 0
-    print(" Reading all files to get data")
-    for hofx_file in hofx_files:
+        # Sub windows, each with their own figures and statistics
+        windows, timed = utils.configTimeWindows(conf, window_begin, window_end)
 
-        # Open file for reading
-        fh = netCDF4.Dataset(hofx_file)
 
-        # Check for channels
-        try:
-            nchans = fh.dimensions["nchans"].size
-        except:
-            nchans = 0
+        # Fields and channels to plot
+        # ---------------------------
+        variables = utils.configSelection(conf, 'field',
+                                          utils.ioda_variables(hofx_files[0], 'ObsValue'))
 
-        # User must provide channel number
+        # User must provide channel number(s) if the files have channels
+        nchans = utils.ioda_nchans(hofx_files[0])
         if nchans != 0:
-            chan = utils.configGetOrFail(conf, 'channel')
-
-        # Number of locations in this file
-        nlocs_final = nlocs_start + fh.dimensions['nlocs'].size
-
-        # Background
-        if nchans != 0:
-            obs[nlocs_start:nlocs_final] = fh.groups['ObsValue'].variables[variable][:,chan-1]
+            channels = utils.configSelection(conf, 'channel', list(range(1, nchans+1)))
+
+
+        # Read the data from all files
+        # -----------------------------
+        utils_profile.phase('read')
+
+        # Every variable is read once for the channels plotted
+        print(" Reading "+str(len(hofx_files))+" files")
+        hofx_groups = ['hofx'+str(n) for n in range(nouter+1)]
+        fields = [(group, variable) for variable in variables
+                  for group in ['ObsValue']+hofx_groups]
+        if timed:
+            fields.append(('MetaData', 'datetime'))
+        if qc_filter is not None:
+            fields += [(qc_filter[0], variable) for variable in variables]
+
+        # Names of the figures, a figure for each channel plotted, and whether a variable has
+        # channels
+        varnames = []
+        channelled = {}
+
+        # With a fixed range the histograms are filled as the files are read and the data is not
+        # kept, otherwise the range is that of the data and all files are read into arrays holding
+        # every location
+        hists = []
+        read_channels = channels if nchans != 0 else None
+        if histogram_range is not None:
+            file_data = utils.iterate_ioda_files(hofx_files, fields, read_channels, read_workers)
         else:
-            obs[nlocs_start:nlocs_final] = fh.groups['ObsValue'].variables[variable][:]
+            file_data = [utils.read_ioda_files(hofx_files, fields, read_channels, read_workers)]
+
+        # h(x) minus observation for each figure and outer loop, with statistics accumulated file
+        # by file for each sub window
+        nlocs_total = 0
+        for nlocs, data in file_data:
+
+            # Columns of each variable, known once the first file is read
+            if varnames == []:
+                for variable in variables:
+                    if data[('ObsValue', variable)].ndim == 2:
+                        channelled[variable] = True
+                        varnames += [variable+"-channel"+str(chan) for chan in channels]
+                    else:
+                        channelled[variable] = False
+                        varnames.append(variable)
+                stats = [utils_stats.stats_init((len(varnames), nouter+1)) for _ in windows]
+                if histogram_range is not None:
+                    edges = np.linspace(histogram_range[0], histogram_range[1], nbins+1)
+                    hists = [[utils_stats.histogram_init(edges, (nouter+1,)) for _ in varnames]
+                             for _ in windows]
+
+            # Sub window of each observation, -1 outside the time range
+            if timed:
+                bins = utils.time_bins(data[('MetaData', 'datetime')], windows[0][0],
+                                       windows[-1][1], len(windows))
+            else:
+                bins = np.zeros(nlocs, dtype=np.int64)
+
+            hofx_file = np.empty((nlocs, len(varnames), nouter+1))
+            j = 0
+            for variable in variables:
+                select = slice(None) if channelled[variable] else (slice(None), np.newaxis)
+                obs = data.pop(('ObsValue', variable))[select]
+                ncols = obs.shape[1]
+                for n, group in enumerate(hofx_groups):
+                    hofx_file[:, j:j+ncols, n] = data.pop((group, variable))[select] - obs
+
+                # Observations rejected by QC are removed from every outer loop like missing
+                # values
+                if qc_filter is not None:
+                    qc = data.pop((qc_filter[0], variable))[select]
+                    hofx_file[:, j:j+ncols, :][~utils.ioda_qc_mask(qc, qc_filter[1])] = np.nan
+                j = j + ncols
+
+            for w in range(len(windows)):
+                hofx_window = hofx_file[bins == w] if timed else hofx_file
+                utils_stats.stats_update(stats[w], hofx_window)
+                if histogram_range is not None:
+                    for j, hist in enumerate(hists[w]):
+                        utils_stats.histogram_update(hist, hofx_window[:, j, :])
+            nlocs_total = nlocs_total + nlocs
+
+        print(" Number of locations for this platform: ", nlocs_total)
+
+        # Histograms over the range of the data of each figure, the same for all outer loops and
+        # sub windows
+        utils_profile.phase('compute')
+        if histogram_range is None:
+            hofx = hofx_file
+            del hofx_file
+            hists = [[] for _ in windows]
+            for j in range(len(varnames)):
+                edges = np.linspace(np.nanmin([stats_window['min'][j] for stats_window in stats]),
+                                    np.nanmax([stats_window['max'][j] for stats_window in stats]),
+                                    nbins+1)
+                for w in range(len(windows)):
+                    hists[w].append(utils_stats.histogram_init(edges, (nouter+1,)))
+                    utils_stats.histogram_update(hists[w][j], hofx[bins == w, j, :])
+            del hofx
+
+        dtformat = "%Y-%m-%dT%H:%M:%S"
+        for (w, (sub_begin, sub_end)), (j, varname) in itertools.product(enumerate(windows),
+                                                                          enumerate(varnames)):
+
+            # Statistics of this figure only
+            stats_plot = {key: value[j] for key, value in stats[w].items()}
+
+            if timed:
+                time_savename = sub_begin.strftime("%Y%m%d_%H%M%S")+"_to_"+ \
+                                sub_end.strftime("%Y%m%d_%H%M%S")
+            else:
+                time_savename = datetime.strftime("%Y%m%d_%H%M%S")
+            savename = os.path.join(output_path, varname+"_"+vmetric+"_"+time_savename)
 
+            if save_histogram:
+                print(" Saving histogram as", savename+".npz")
+                utils_stats.histogram_save(savename+".npz", hists[w][j], stats_plot,
+                                           {'name': varname,
+                                            'window begin': sub_begin.strftime(dtformat),
+                                            'window end': sub_end.strftime(dtformat)})
 
-        # Set missing values to nans
-        obs[nlocs_start:nlocs_final] = np.where(np.abs(obs[nlocs_start:nlocs_final]) < missing,
-                                       obs[nlocs_start:nlocs_final], float("NaN"))
+            plots.append({'name': varname, 'hist': hists[w][j], 'stats': stats_plot,
+                          'window begin': sub_begin, 'window end': sub_end,
+                          'savename': savename})
 
-        # Loop over outer loops
-        for n in range(nouter+1):
-            if nchans != 0:
-                hofx[nlocs_start:nlocs_final,n] = fh.groups['hofx'+str(n)].variables[variable][:,chan-1] - \
-                                                  obs[nlocs_start:nlocs_final]
+    else:
+
+        # Sum histograms saved by earlier runs
+        # ------------------------------------
+        utils_profile.phase('file discovery')
+
+        isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
+        histogram_files_template = utils.stringReplaceDatetimeTemplate(isodatestr,
+                                                                       histogram_files_template)
+
+        histogram_files = sorted(glob.glob(histogram_files_template))
+
+        if histogram_files==[]:
+            utils.abort("No histogram files matching the input string")
+
+        # Histograms are summed by name so the files can hold several variables and channels
+        utils_profile.phase('read')
+        print(" Summing "+str(len(histogram_files))+" histograms")
+        dtformat = "%Y-%m-%dT%H:%M:%S"
+        summed = {}
+        for histogram_file in histogram_files:
+            hist_file, stats_file, metadata = utils_stats.histogram_load(histogram_file)
+            window_begin = dt.datetime.strptime(metadata['window begin'], dtformat)
+            window_end = dt.datetime.strptime(metadata['window end'], dtformat)
+            if metadata['name'] not in summed:
+                summed[metadata['name']] = {'name': metadata['name'], 'hist': hist_file,
+                                            'stats': stats_file, 'window begin': window_begin,
+                                            'window end': window_end}
             else:
-                hofx[nlocs_start:nlocs_final,n] = fh.groups['hofx'+str(n)].variables[variable][:] - \
-                                                  obs[nlocs_start:nlocs_final]
+                plot = summed[metadata['name']]
+                utils_stats.histogram_merge(plot['hist'], hist_file)
+                utils_stats.stats_merge(plot['stats'], stats_file)
+                plot['window begin'] = min(plot['window begin'], window_begin)
+                plot['window end'] = max(plot['window end'], window_end)
+
+        for plot in summed.values():
+            print(" Number of locations summed for "+plot['name']+": ",
+                  int(np.sum(plot['stats']['count'][0])))
+            plot['savename'] = os.path.join(output_path, plot['name']+"_"+vmetric+"_sum_"+
+                                            plot['window begin'].strftime("%Y%m%d_%H%M%S")+"_to_"+
+                                            plot['window end'].strftime("%Y%m%d_%H%M%S"))
+            plots.append(plot)
+
+    # Make a figure for each variable and channel
+    # -------------------------------------------
+    for plot in plots:
+        plot_innovations(plot, vmetric, units, plotformat, smoothing, kde_bandwidth)
+
+# --------------------------------------------------------------------------------------------------
 
-        # Set start ready for next file
-        nlocs_start = nlocs_final
+def plot_innovations(plot, vmetric, units, plotformat, smoothing, kde_bandwidth):
 
-        fh.close()
+    # Import plotting and scipy here so they are only loaded when the application runs
+    import matplotlib.pyplot as plt
+    import scipy.interpolate
 
     # Figure filename
     # ---------------
-    if nchans != 0:
-        savename = os.path.join(output_path, varname+"-channel"+str(chan)+"_"+vmetric+"_"+datetime.strftime("%Y%m%d_%H%M%S")+"."+plotformat)
-    else:
-        savename = os.path.join(output_path, varname+"_"+vmetric+"_"+datetime.strftime("%Y%m%d_%H%M%S")+"."+plotformat)
+    utils_profile.phase('compute')
+    savename = plot['savename']+"."+plotformat
+    varname = plot['name']
+    window_begin = plot['window begin']
+    window_end = plot['window end']
+    hist = plot['hist']
+
+    stats = utils_stats.stats_final(plot['stats'])
+    nouter = hist['counts'].shape[1] - 1
 
 
     # Statistics arrays
-    hist  = np.zeros((nbins, nouter+1))
+    nbins = len(hist['edges']) - 1
     edges = np.zeros((nbins, nouter+1))
     splines = np.zeros((nbins, nouter+1))
     stddev = np.zeros(nouter+1)
 
+    # Kernel density estimate of all outer loops at once
+    if smoothing == 'kde':
+        if kde_bandwidth is None:
+            kde_bandwidth = utils_stats.silverman_bandwidth(stats['std'], stats['count'])
+        splines[:,:] = utils_stats.histogram_kde(hist, kde_bandwidth)
+
     # Create figure
+    utils_profile.phase('render')
     fig, ax = plt.subplots(figsize=(12, 7.5))
 
     # Loop over outer loops, compute stats and plot
     for n in range(nouter+1):
 
-        # Generate histograms
-        hist[:,n], edges_hist = np.histogram(hofx[~np.isnan(hofx[:,n]),n], bins=nbins)
+        # Centres of the histogram bins
+        utils_profile.phase('compute')
+        edges_hist = hist['edges']
         edges[:,n] = edges_hist[:-1] + (edges_hist[1] - edges_hist[0])/2
 
         # Generate splines for plotting
-        spline = scipy.interpolate.UnivariateSpline(edges[:,n], hist[:,n], s=None)
-        splines[:,n] = spline(edges[:,n])
+        if smoothing == 'spline':
+            spline = scipy.interpolate.UnivariateSpline(edges[:,n], hist['counts'][:,n], s=None)
+            splines[:,n] = spline(edges[:,n])
 
         # Standard deviation
-        stddev[n] = np.nanstd(hofx[:, n])
+        stddev[n] = stats['std'][n]
 
         # Print basic statistics
-        print("\n Statisitcs for outer loop", n)
-        print("  Mean observation minus h(x) = ", np.nanmean(hofx[:, n]))
+        print("\n Statisitcs for "+varname+" outer loop", n)
+        print("  Mean observation minus h(x) = ", stats['mean'][n])
         print("  Sdev observation minus h(x) = ", stddev[n])
 
         if n == 0:
@@ -229,6 +416,7 @@ def hofx_innovations(datetime, conf):
         else:
             label = "Obs minus h(x) after "+utils.ordinalNumber(n)+" outer loop"
 
+        utils_profile.phase('render')
         ax.plot(edges[:,n], splines[:,n], label=label)
         plt.xlim(-2*stddev[n], 2*stddev[n])
 
@@ -236,13 +424,15 @@ def hofx_innovations(datetime, conf):
     ax.tick_params(labelbottom=True, labeltop=True, labelleft=True, labelright=True)
     plt.title("Observation statistics: "+varname.replace("_"," ")+" "+vmetric+" | "+
               window_begin.strftime("%Y%m%d %Hz")+" to "+
-              (window_begin+window_length).strftime("%Y%m%d %Hz"), y=1.08)
+              window_end.strftime("%Y%m%d %Hz"), y=1.08)
     if not units==None:
         plt.xlabel("Observation minus h(x) ["+units+"]")
     else:
         plt.xlabel("Observation minus h(x)")
     plt.ylabel("Frequency")
+    utils_profile.phase('save')
     print(" Saving figure as", savename, "\n")
     plt.savefig(savename)
+    plt.close(fig)
 
 # --------------------------------------------------------------------------------------------------
@@ -3,17 +3,15 @@
 # This software is licensed under the terms of the Apache Licence Version 2.0
 # which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
 
-import cartopy.crs as ccrs
 import datetime as dt
 import glob
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
-import netCDF4
+import itertools
 import numpy as np
 import os
 
 import fv3jeditools.utils as utils
+import fv3jeditools.utils_profile as utils_profile
+import fv3jeditools.utils_stats as utils_stats
 
 # --------------------------------------------------------------------------------------------------
 ## @package hofx_map
@@ -30,13 +28,26 @@ import fv3jeditools.utils as utils
 #  offset option described below can be used.
 #
 #  hofx files       | File(s) to parse. E.g. aircraft_hofx_%Y%m%d%H.nc4
-#  variable         | Variable to plot (either something from the file or variable@omb)
+#  metric           | Group to plot (either a group in the file or omb)
+#  field            | Variable(s) to plot, one, a list or all. Files are read once for all of them
+#  channel          | Channel(s) to plot for files with channels, one, a list or all
 #  units            | Units of the field being plotted
 #  window length    | Window length (hours)
 #  time offset      | Offset of time in filename from window center (hours), e.g. -3, +3 or 0
 #  plot format      | Output format for plots ([png] or pdf)
 #  colorbar minimum | User defined colorbar minimum
 #  colorbar maximum | User defined colorbar maximum
+#  read workers     | Number of processes reading the hofx files in parallel [4]
+#  plot style       | [scatter] to draw every observation or gridded to draw a statistic of the
+#                   | observations in each cell of a grid
+#  grid             | Grid for the gridded plot style, [lonlat] or equal area
+#  grid spacing     | Cell size of the grid in degrees [2.0]
+#  grid statistic   | Statistic in each cell, [mean], std, count or rms
+#  time range       | Only use observations between [first, last] hours from the start of the
+#                   | window, e.g. [0, 3], using MetaData datetime
+#  sub window length| Length (hours) of sub windows that each get a figure, e.g. 1 for hourly maps
+#  qc filter        | Only use observations with accepted flags in this QC group, e.g. EffectiveQC
+#  qc accepted      | QC flags of the observations that are used, one or a list [0]
 #
 #
 #  This function can be used to plot fields that are on a lon/lat grid as written by fv3-jedi.
@@ -45,6 +56,11 @@ import fv3jeditools.utils as utils
 
 def hofx_map(datetime, conf):
 
+    # Import plotting and netCDF libraries here so they are only loaded when the application runs
+    import cartopy.crs as ccrs
+    import matplotlib
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as mticker
 
     # Parse configuration
     # -------------------
@@ -57,10 +73,6 @@ def hofx_map(datetime, conf):
     metric = utils.configGetOrFail(conf, 'metric')
 
 
-    # Get field to plot
-    field = utils.configGetOrFail(conf, 'field')
-
-
     # Get window length
     window_length = dt.timedelta(hours=int(utils.configGetOrFail(conf, 'window length')))
 
@@ -91,6 +103,26 @@ def hofx_map(datetime, conf):
     except:
         plotformat = 'png'
 
+    # Number of processes reading the files
+    read_workers = utils.configGet(conf, 'read workers', 4)
+
+    # Draw every observation (scatter) or a statistic on a grid (gridded)
+    plot_style = utils.configGet(conf, 'plot style', 'scatter')
+    if plot_style not in ['scatter', 'gridded']:
+        utils.abort('hofx_map: plot style must be scatter or gridded')
+
+    # Grid for the gridded plot style
+    grid = utils.configGet(conf, 'grid', 'lonlat')
+    if grid not in ['lonlat', 'equal area']:
+        utils.abort('hofx_map: grid must be lonlat or equal area')
+    grid_spacing = utils.configGet(conf, 'grid spacing', 2.0)
+    grid_statistic = utils.configGet(conf, 'grid statistic', 'mean')
+    if grid_statistic not in ['mean', 'std', 'count', 'rms']:
+        utils.abort('hofx_map: grid statistic must be mean, std, count or rms')
+
+    # Observations used according to their QC flags
+    qc_filter = utils.configQCFilter(conf)
+
     # Get output path for plots
     try:
         output_path = conf['output path']
@@ -103,12 +135,13 @@ def hofx_map(datetime, conf):
 
     # Get list of hofx files to read
     # ------------------------------
+    utils_profile.phase('file discovery')
 
     # Replace datetime in logfile name
     isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
     hofx_files_template = utils.stringReplaceDatetimeTemplate(isodatestr, hofx_files_template)
 
-    hofx_files = glob.glob(hofx_files_template)
+    hofx_files = sorted(glob.glob(hofx_files_template))
 
     if hofx_files==[]:
         utils.abort("No hofx files matching the input string")
@@ -117,183 +150,271 @@ def hofx_map(datetime, conf):
     # Compute window begin time
     # -------------------------
     window_begin = datetime + time_offset - window_length/2
+    window_end = window_begin + window_length
 
+    # Sub windows, each with their own figures and statistics
+    windows, timed = utils.configTimeWindows(conf, window_begin, window_end)
 
-    # Loop over data files and read
-    # -----------------------------
-    odat = []
-    lons = []
-    lats = []
-    time = []
-    for hofx_file in hofx_files:
-
-        # Message file being read
-        print(" Reading "+hofx_file)
-
-        # Open the file
-        fh = netCDF4.Dataset(hofx_file)
-
-        # Check for channels
-        try:
-            nchans = fh.dimensions["nchans"].size
-        except:
-            nchans = 0
-
-        # User must provide channel number
-        if nchans != 0:
-            chan = utils.configGetOrFail(conf, 'channel')
-
-            # Read metric
-            if metric=='omb':
-                odat_proc = fh.groups['ObsValue'].variables[field][:,chan-1] - fh.groups['hofx'].variables[field][:,chan-1]
-            else:
-                odat_proc = fh.groups[metric].variables[field][:,chan-1]
-
-        else:
-
-            # Read metric
-            if metric=='omb':
-                odat_proc = fh.groups['ObsValue'].variables[field][:] - fh.groups['hofx'].variables[field][:]
-            else:
-                odat_proc = fh.groups[metric].variables[field][:]
-
-        # Read metadata
-        lons_proc = fh.groups['MetaData'].variables['longitude'][:]
-        lats_proc = fh.groups['MetaData'].variables['latitude'][:]
-        time_proc = fh.groups['MetaData'].variables['datetime'][:]
 
+    # Fields and channels to plot
+    # ---------------------------
+    fields = utils.configSelection(conf, 'field', utils.ioda_variables(hofx_files[0], metric))
 
-        for m in range(len(odat_proc)):
-            odat.append(odat_proc[m])
-            lons.append(lons_proc[m])
-            lats.append(lats_proc[m])
+    # User must provide channel number(s) if the files have channels
+    nchans = utils.ioda_nchans(hofx_files[0])
+    if nchans != 0:
+        channels = utils.configSelection(conf, 'channel', list(range(1, nchans+1)))
 
-        fh.close()
 
-    # Figure filename
-    # ---------------
-    field_savename = field
-    if nchans != 0:
-        field_savename = field_savename+"-channel"+str(chan)
-    savename = os.path.join(output_path, field_savename+"_"+metric+"_"+datetime.strftime("%Y%m%d_%H%M%S")+"."+plotformat)
+    # Read the data from all files
+    # -----------------------------
+    utils_profile.phase('read')
+
+    # Every field is read once for the channels plotted. For the gridded plot the statistics are
+    # accumulated file by file, the observations themselves are only kept when they are drawn
+    # individually and are then read into arrays holding all files.
+    if plot_style == 'gridded':
+        lon_edges, lat_edges = utils_stats.grid_edges(grid_spacing, grid == 'equal area')
+        ncells = (len(lat_edges)-1)*(len(lon_edges)-1)
+
+    plot_channels = {}
+    stats = {}
+    grid_stats = {}
+    observations = {}
+
+    print(" Reading "+str(len(hofx_files))+" files")
+    read_fields = [(metric, field) for field in fields] + [('MetaData', 'longitude'),
+                                                           ('MetaData', 'latitude')]
+    if timed:
+        read_fields.append(('MetaData', 'datetime'))
+    if qc_filter is not None:
+        read_fields += [(qc_filter[0], field) for field in fields]
+    read_channels = channels if nchans != 0 else None
+    if plot_style == 'gridded':
+        file_data = utils.iterate_ioda_files(hofx_files, read_fields, read_channels, read_workers)
+    else:
+        file_data = [utils.read_ioda_files(hofx_files, read_fields, read_channels, read_workers)]
+    for nlocs, data in file_data:
 
-    # Set missing values to nans
-    missing = 9.0e+30
-    odat = np.where(np.abs(odat) < missing, odat, float("NaN"))
-    
-    numobs = len(odat)
+        # Sub window of each observation, -1 outside the time range
+        if timed:
+            bins = utils.time_bins(data[('MetaData', 'datetime')], windows[0][0], windows[-1][1],
+                                   len(windows))
+        else:
+            bins = np.zeros(nlocs, dtype=np.int64)
+        in_window = [bins == w for w in range(len(windows))]
+
+        lons = data[('MetaData', 'longitude')]
+        lats = data[('MetaData', 'latitude')]
+        if plot_style == 'gridded':
+            located = ~np.isnan(lons) & ~np.isnan(lats)
+            cells = utils_stats.grid_cells(lons[located], lats[located], lon_edges, lat_edges)
+            bins_located = bins[located]
+
+        for field in fields:
+
+            # Data with a column for each channel plotted
+            odat = data.pop((metric, field))
+            if odat.ndim == 2:
+                plot_channels.setdefault(field, channels)
+            else:
+                plot_channels.setdefault(field, [None])
+                odat = odat[:, np.newaxis]
+
+            # Observations rejected by QC are removed like missing values
+            if qc_filter is not None:
+                qc = data.pop((qc_filter[0], field)).reshape(odat.shape)
+                odat[~utils.ioda_qc_mask(qc, qc_filter[1])] = np.nan
+
+            if field not in stats:
+                stats[field] = [utils_stats.stats_init(odat.shape[1]) for _ in windows]
+            for w in range(len(windows)):
+                utils_stats.stats_update(stats[field][w], odat[in_window[w]])
+
+            if plot_style == 'gridded':
+                odat_located = odat[located]
+                for (j, w) in itertools.product(range(odat.shape[1]), range(len(windows))):
+                    in_cell_window = bins_located == w
+                    utils_stats.stats_update_binned(grid_stats.setdefault((field, j, w),
+                                                    utils_stats.stats_init(ncells)),
+                                                    cells[in_cell_window],
+                                                    odat_located[in_cell_window, j])
+            else:
+                observations[field] = odat
+
+    # Missing values are already nans
+    utils_profile.phase('compute')
+
+
+    # Make a figure for each field, channel and sub window
+    # ---------------------------------------------------
+    for field in fields:
+
+        stats_field = [utils_stats.stats_final(stats_window) for stats_window in stats[field]]
+        if plot_style == 'scatter':
+            odat_field = observations.pop(field)
+
+        for (j, chan), (w, (sub_begin, sub_end)) in itertools.product(
+            enumerate(plot_channels[field]), enumerate(windows)):
+
+            # Figure filename
+            # ---------------
+            utils_profile.phase('compute')
+            field_savename = field
+            if chan is not None:
+                field_savename = field_savename+"-channel"+str(chan)
+            metric_savename = metric
+            if plot_style == 'gridded':
+                metric_savename = metric_savename+"_gridded-"+grid_statistic
+            if timed:
+                time_savename = sub_begin.strftime("%Y%m%d_%H%M%S")+"_to_"+ \
+                                sub_end.strftime("%Y%m%d_%H%M%S")
+            else:
+                time_savename = datetime.strftime("%Y%m%d_%H%M%S")
+            savename = os.path.join(output_path, field_savename+"_"+metric_savename+"_"+
+                                    time_savename+"."+plotformat)
 
-    obarray = np.empty([numobs, 3])
 
-    obarray[:, 0] = odat
-    obarray[:, 1] = lons
-    obarray[:, 2] = lats
+            # Compute and print some stats for the data
+            # -----------------------------------------
+            stdev = stats_field[w]['std'][j]   # Standard deviation
+            omean = stats_field[w]['mean'][j]  # Mean of the data
+            datmi = stats_field[w]['min'][j]   # Min of the data
+            datma = stats_field[w]['max'][j]   # Max of the data
 
+            print("Plotted data statistics: "+field_savename+" "+time_savename)
+            print("Number of observations: ", int(stats_field[w]['count'][j]))
+            print("Mean: ", omean)
+            print("Standard deviation: ", stdev)
+            print("Minimum ", datmi)
+            print("Maximum: ", datma)
 
-    # Compute and print some stats for the data
-    # -----------------------------------------
-    stdev = np.nanstd(obarray[:, 0])  # Standard deviation
-    omean = np.nanmean(obarray[:, 0]) # Mean of the data
-    datmi = np.nanmin(obarray[:, 0])  # Min of the data
-    datma = np.nanmax(obarray[:, 0])  # Max of the data
 
-    print("Plotted data statistics: ")
-    print("Mean: ", omean)
-    print("Standard deviation: ", stdev)
-    print("Minimum ", datmi)
-    print("Maximum: ", datma)
+            # Norm for scatter plot
+            # ---------------------
+            norm = None
 
 
-    # Norm for scatter plot
-    # ---------------------
-    norm = None
+            # Min max for colorbar
+            # --------------------
+            if datmi < 0:
+              cmax = datma
+              cmin = datmi
+              cmap = 'RdBu'
+            else:
+              cmax = omean+stdev
+              cmin = np.maximum(omean-stdev, 0.0)
+              cmap = 'viridis'
+
+            if metric == 'PreQC' or metric == 'EffectiveQC':
+              cmin = datmi
+              cmax = datma
+
+              # Specialized colorbar for integers
+              cmap = plt.cm.jet
+              cmaplist = [cmap(i) for i in range(cmap.N)]
+              cmaplist[1] = (.5, .5, .5, 1.0)
+              cmap = matplotlib.colors.LinearSegmentedColormap.from_list('Custom cmap', cmaplist, cmap.N)
+              bounds = np.insert(np.linspace(0.5, int(cmax)+0.5, int(cmax)+1), 0, 0)
+              norm = matplotlib.colors.BoundaryNorm(bounds, cmap.N)
+
+            # If using omb then use standard deviation for the cmin/cmax
+            if metric=='omb' or metric=='ombg' or metric=='oman':
+              cmax = stdev
+              cmin = -stdev
+
+            # Statistic in each cell of the grid
+            if plot_style == 'gridded':
+              gridded = utils_stats.stats_final(grid_stats.pop((field, j, w)))[grid_statistic]
+              gridded = gridded.reshape(len(lat_edges)-1, len(lon_edges)-1)
+
+              # Statistics that are positive use their own range
+              if grid_statistic != 'mean':
+                norm = None
+                cmin = 0.0
+                cmax = np.nanmax(gridded)
+                cmap = 'viridis'
+              if grid_statistic == 'count':
+                gridded = np.ma.masked_equal(gridded, 0)
+
+            # Override with user chosen limits
+            if (colmin!=None):
+              print("Using user provided minimum for colorbar")
+              cmin = colmin
+            if (colmax!=None):
+              print("Using user provided maximum for colorbar")
+              cmax = colmax
+
+
+            # Create figure
+            # -------------
+            utils_profile.phase('render')
+
+            fig = plt.figure(figsize=(10, 5))
+
+            # initialize the plot pointing to the projection
+            ax = plt.axes(projection=ccrs.PlateCarree(central_longitude=0))
+
+            # plot grid lines
+            gl = ax.gridlines(crs=ccrs.PlateCarree(central_longitude=0), draw_labels=True,
+                              linewidth=1, color='gray', alpha=0.5, linestyle='-')
+
+            gl.xlabel_style = {'size': 10, 'color': 'black'}
+            gl.ylabel_style = {'size': 10, 'color': 'black'}
+            gl.xlocator = mticker.FixedLocator(
+                [-180, -135, -90, -45, 0, 45, 90, 135, 179.9])
+            ax.set_ylabel("Latitude",  fontsize=7)
+            ax.set_xlabel("Longitude", fontsize=7)
+
+            ax.tick_params(labelbottom=False, labeltop=False, labelleft=False, labelright=False)
+
+            if plot_style == 'gridded':
+
+              # gridded data, a single mesh however many observations there are
+              if norm is None:
+                sc = ax.pcolormesh(lon_edges, lat_edges, gridded, transform=ccrs.PlateCarree(),
+                                   cmap=cmap, vmin=cmin, vmax=cmax)
+              else:
+                sc = ax.pcolormesh(lon_edges, lat_edges, gridded, transform=ccrs.PlateCarree(),
+                                   cmap=cmap, norm=norm)
 
+            else:
 
-    # Min max for colorbar
-    # --------------------
-    if np.nanmin(obarray[:, 0]) < 0:
-      cmax = datma
-      cmin = datmi
-      cmap = 'RdBu'
-    else:
-      cmax = omean+stdev
-      cmin = np.maximum(omean-stdev, 0.0)
-      cmap = 'viridis'
-
-    if metric == 'PreQC' or metric == 'EffectiveQC':
-      cmin = datmi
-      cmax = datma
-
-      # Specialized colorbar for integers
-      cmap = plt.cm.jet
-      cmaplist = [cmap(i) for i in range(cmap.N)]
-      cmaplist[1] = (.5, .5, .5, 1.0)
-      cmap = matplotlib.colors.LinearSegmentedColormap.from_list('Custom cmap', cmaplist, cmap.N)
-      bounds = np.insert(np.linspace(0.5, int(cmax)+0.5, int(cmax)+1), 0, 0)
-      norm = matplotlib.colors.BoundaryNorm(bounds, cmap.N)
-
-    # If using omb then use standard deviation for the cmin/cmax
-    if metric=='omb' or metric=='ombg' or metric=='oman':
-      cmax = stdev
-      cmin = -stdev
-
-    # Override with user chosen limits
-    if (colmin!=None):
-      print("Using user provided minimum for colorbar")
-      cmin = colmin
-    if (colmax!=None):
-      print("Using user provided maximum for colorbar")
-      cmax = colmax
-
-
-    # Create figure
-    # -------------
-
-    fig = plt.figure(figsize=(10, 5))
-
-    # initialize the plot pointing to the projection
-    ax = plt.axes(projection=ccrs.PlateCarree(central_longitude=0))
-
-    # plot grid lines
-    gl = ax.gridlines(crs=ccrs.PlateCarree(central_longitude=0), draw_labels=True,
-                      linewidth=1, color='gray', alpha=0.5, linestyle='-')
-
-    gl.xlabel_style = {'size': 10, 'color': 'black'}
-    gl.ylabel_style = {'size': 10, 'color': 'black'}
-    gl.xlocator = mticker.FixedLocator(
-        [-180, -135, -90, -45, 0, 45, 90, 135, 179.9])
-    ax.set_ylabel("Latitude",  fontsize=7)
-    ax.set_xlabel("Longitude", fontsize=7)
-
-    ax.tick_params(labelbottom=False, labeltop=False, labelleft=False, labelright=False)
-
-    # scatter data
-    sc = ax.scatter(obarray[:, 1], obarray[:, 2],
-                    c=obarray[:, 0], s=4, linewidth=0,
-                    transform=ccrs.PlateCarree(), cmap=cmap, vmin=cmin, vmax = cmax, norm=norm)
-
-    # colorbar
-    cbar = plt.colorbar(sc, ax=ax, orientation="horizontal", pad=.1, fraction=0.06,)
-    if not units==None:
-        cbar.ax.set_ylabel(units, fontsize=10)
-
-    # plot globally
-    ax.set_global()
-
-    # draw coastlines
-    ax.coastlines()
-
-    # figure labels
-    plt.title("Observation statistics: "+field.replace("_"," ")+" "+metric+" | "+
-              window_begin.strftime("%Y%m%d %Hz")+" to "+
-              (window_begin+window_length).strftime("%Y%m%d %Hz"), y=1.08)
-    ax.text(0.45, -0.1,   'Longitude', transform=ax.transAxes, ha='left')
-    ax.text(-0.08, 0.4, 'Latitude', transform=ax.transAxes,
-            rotation='vertical', va='bottom')
-
-    # show plot
-    print(" Saving figure as", savename, "\n")
-    plt.savefig(savename)
+              # scatter data
+              in_window = (bins == w) & ~np.isnan(odat_field[:, j])
+              sc = ax.scatter(lons[in_window], lats[in_window],
+                              c=odat_field[in_window, j], s=4, linewidth=0,
+                              transform=ccrs.PlateCarree(), cmap=cmap, vmin=cmin, vmax = cmax, norm=norm)
+
+            # colorbar
+            cbar = plt.colorbar(sc, ax=ax, orientation="horizontal", pad=.1, fraction=0.06,)
+            if plot_style == 'gridded' and grid_statistic == 'count':
+                cbar.ax.set_ylabel('Number of observations', fontsize=10)
+            elif not units==None:
+                cbar.ax.set_ylabel(units, fontsize=10)
+
+            # plot globally
+            ax.set_global()
+
+            # draw coastlines
+            ax.coastlines()
+
+            # figure labels
+            title_metric = metric
+            if plot_style == 'gridded':
+                title_metric = title_metric+" ("+grid_statistic+" per "+str(grid_spacing)+" degree cell)"
+            plt.title("Observation statistics: "+field_savename.replace("_"," ")+" "+title_metric+" | "+
+                      sub_begin.strftime("%Y%m%d %Hz")+" to "+
+                      sub_end.strftime("%Y%m%d %Hz"), y=1.08)
+            ax.text(0.45, -0.1,   'Longitude', transform=ax.transAxes, ha='left')
+            ax.text(-0.08, 0.4, 'Latitude', transform=ax.transAxes,
+                    rotation='vertical', va='bottom')
+
+            # show plot
+            utils_profile.phase('save')
+            print(" Saving figure as", savename, "\n")
+            plt.savefig(savename)
+            plt.close(fig)
 
 
 
@@ -3,12 +3,12 @@
 # This software is licensed under the terms of the Apache Licence Version 2.0
 # which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
 
-import matplotlib.pyplot as plt
 import numpy as np
 import os
-import re
 
 import fv3jeditools.utils as utils
+import fv3jeditools.utils_log as utils_log
+import fv3jeditools.utils_profile as utils_profile
 
 # --------------------------------------------------------------------------------------------------
 ## @package log_timing
@@ -17,9 +17,13 @@ import fv3jeditools.utils as utils
 #
 #  Configuration options:
 #  ----------------------
-#  log file          | The log file to parse the statistics from
+#  log file          | The log file to parse the statistics from, may be compressed (.gz, .bz2
+#                    | or .xz)
+#  log archive       | Tar archive holding the log, log file is then the name of the log in it
 #  number of methods | Number of methods to show in the pie chart. Code will pick n most expensive [10]
 #  plot format       | The extension used for the file name, png or pdf
+#  log cache         | Keep the parsed log for later runs in <log file>.series.json (true), in a
+#                    | directory (path) or not at all ([false])
 #
 #
 #  This function takes a yaml file configuration as well as a datetime. It will plot the timing
@@ -29,6 +33,8 @@ import fv3jeditools.utils as utils
 
 def log_timing(datetime, conf):
 
+    # Import matplotlib here so it is only loaded when the application runs
+    import matplotlib.pyplot as plt
 
     # Log file to parse
     # -----------------
@@ -51,6 +57,16 @@ def log_timing(datetime, conf):
     except:
         plotformat = 'png'
 
+    # Cache of the parsed log
+    # -----------------------
+    log_cache = utils.configGet(conf, 'log cache', False)
+
+    # Tar archive holding the log
+    try:
+        log_archive = conf['log archive']
+    except:
+        log_archive = None
+
     # Get output path for plots
     # -------------------------
     try:
@@ -66,6 +82,8 @@ def log_timing(datetime, conf):
     # --------------------------------
     isodatestr = datetime.strftime("%Y-%m-%dT%H:%M:%S")
     log_file = utils.stringReplaceDatetimeTemplate(isodatestr, log_file)
+    if log_archive is not None:
+        log_archive = utils.stringReplaceDatetimeTemplate(isodatestr, log_archive)
 
 
     # Read file and gather norm information
@@ -73,68 +91,19 @@ def log_timing(datetime, conf):
     print(" Reading timings from ", log_file)
 
 
-    # Open the file ready for reading
-    # -------------------------------
-    if os.path.exists(log_file):
-        file = open(log_file, "r")
-    else:
-        utils.abort('Log file not found.')
-
-
-    # Get all lines that match the search patterns
-    # --------------------------------------------
-    oops_stats = []
-    reg = re.compile("OOPS_STATS")
-    for line in file:
-        if bool(re.match(reg, line.rstrip())):
-            oops_stats.append(line.rstrip())
-
-
-    # Extract lines containing raw stats
-    # ---------------------------------------
-    search_str = "------------------------- Timing Statistics"
-    reg = re.compile("OOPS_STATS oops")
-    raw_timings = []
-    take_line = -1
-    for oops_stat in oops_stats:
-        if re.search(search_str, oops_stat):
-            take_line *= -1
-        if take_line == 1 and bool(re.match(reg, oops_stat)):
-            raw_timings.append(oops_stat)
-    del raw_timings[0:2]
-
-    # Remove totals
-    del raw_timings[-1]
-
-
-    # Extract lines containing parallel stats
-    # ---------------------------------------
-    search_str = "Parallel Timing Statistics"
-    reg = re.compile("OOPS_STATS oops")
-    par_timings = []
-    take_line = -1
-    for oops_stat in oops_stats:
-        if re.search(search_str, oops_stat):
-            take_line *= -1
-        if take_line == 1 and bool(re.match(reg, oops_stat)):
-            par_timings.append(oops_stat)
-    del par_timings[0:3]
-
-    # Remove totals
-    del par_timings[-2:]
-
-
-    # Place times and names in to numpy arrays
-    # ----------------------------------------
-    raw_timing_mname = np.empty(len(raw_timings), dtype='object')
-    raw_timing_ttime = np.empty(len(raw_timings))
-    raw_timing_pcall = np.empty(len(raw_timings))
-    n = 0
-    for raw_timing in raw_timings:
-        raw_timing_mname[n] = raw_timing.split(": ")[0].split()[1]
-        raw_timing_ttime[n] = float(raw_timing.split(": ")[1].split()[0])
-        raw_timing_pcall[n] = float(raw_timing.split(": ")[1].split()[3])
-        n += 1
+    # Parse the log in one pass
+    # -------------------------
+    utils_profile.phase('read')
+    series = utils_log.read_log(log_file, log_cache, log_archive)
+
+
+    # Rows of the timing table without the run and total timers
+    # ---------------------------------------------------------
+    utils_profile.phase('compute')
+    raw_timings = series['timing']['Timing Statistics']
+    raw_timing_mname = np.array(raw_timings['names'][2:-1], dtype='object')
+    raw_timing_ttime = np.array([values[0] for values in raw_timings['values'][2:-1]])
+    raw_timing_pcall = np.array([values[3] for values in raw_timings['values'][2:-1]])
 
     # Total time for times being considered
     # -------------------------------------
@@ -162,7 +131,10 @@ def log_timing(datetime, conf):
 
     # Create figures
     # --------------
+    utils_profile.phase('render')
     savename = os.path.basename(log_file)
+    if savename.endswith(tuple(utils_log.compressed_log_openers)):
+        savename = os.path.splitext(savename)[0]
     savename = os.path.splitext(savename)[0]
     savename_total = savename+"_method_total_time_"+datetime.strftime("%Y%m%d_%H%M%S")+"."+plotformat
     savename_total = os.path.join(output_path,savename_total)
@@ -176,15 +148,18 @@ def log_timing(datetime, conf):
     plt.title("JEDI application timings per method (total time = "+'{:.1f}'.format(np.sum(raw_timing_ttime_time_plot)) + "ms)")
     ax.legend(wedges, raw_timing_ttime_name_plot, title="Methods", loc="center left",
               bbox_to_anchor=(1, 0, 0.5, 1))
+    utils_profile.phase('save')
     print(" Saving figure as", savename_total, "\n")
     plt.savefig(savename_total)
 
+    utils_profile.phase('render')
     fig, ax = plt.subplots(figsize=(20, 7.5))
     wedges, texts, autotexts = ax.pie(raw_timing_pcall_time_plot, autopct=lambda p: '{:.1f}'.format(p * np.sum(raw_timing_pcall_time_plot) / 100),
                                       shadow=True, startangle=90)
     plt.title("JEDI application timings per method per call (ms)")
     ax.legend(wedges, raw_timing_pcall_name_plot, title="Methods", loc="center left",
               bbox_to_anchor=(1, 0, 0.5, 1))
+    utils_profile.phase('save')
     print(" Saving figure as", savename_percall, "\n")
     plt.savefig(savename_percall)
 
@@ -3,12 +3,12 @@
 # This software is licensed under the terms of the Apache Licence Version 2.0
 # which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
 
-import matplotlib.pyplot as plt
-import netCDF4
+import concurrent.futures
 import numpy as np
 import os
 
 import fv3jeditools.utils as utils
+import fv3jeditools.utils_profile as utils_profile
 
 # --------------------------------------------------------------------------------------------------
 ## @package obs_scatter
@@ -18,7 +18,28 @@ import fv3jeditools.utils as utils
 #  Configuration options:
 #  ----------------------
 #
-#
+#  ioda experiment files | List of IODA files from the experiment
+#  ioda reference files  | List of IODA files to compare with, in the same order
+#  experiment metrics    | List of groups to plot from the experiment files, e.g. hofx or omb
+#  reference metrics     | List of groups to plot from the reference files, e.g. GsiHofXBc
+#  marker size           | Size of the scatter markers [2]
+#  output path           | Directory for the figures [./]
+#  figure file type      | Format of the figures, e.g. pdf or [png]
+#  read all channels     | Read every channel of a variable at once ([true]) or one channel at a
+#                        | time (false), which uses less memory for instruments with many channels
+#  render workers        | Number of processes rendering the figures in parallel [1]. Each figure
+#                        | is rendered as soon as its data is ready, at most two per process wait
+#  plot style            | [scatter] to draw every observation or density to draw the number
+#                        | of observations in bins with a log color scale
+#  density bins          | Number of bins along each axis for the density plot style [200]
+#  qc filter             | Only use observations with accepted flags in this QC group of the
+#                        | experiment files, e.g. EffectiveQC
+#  qc accepted           | QC flags of the observations that are used, one or a list [0]
+#  match observations    | Pair the observations of the two files by location and time ([true])
+#                        | rather than by their order in the files (false), so that the files can
+#                        | have a different number or order of observations
+#  match distance        | Tolerance for the distance between matching observations (km) [0.1]
+#  match time            | Tolerance for the time between matching observations (seconds) [1.0]
 #
 #  This function can be used to plot observation type data comparing two experiments in a scatter
 #
@@ -28,6 +49,9 @@ import fv3jeditools.utils as utils
 
 def obs_scatter(datetime, conf):
 
+    # Import netCDF here so it is only loaded when the application runs, figures are rendered by
+    # render_figure
+    import netCDF4
 
     # Parse configuration
     # -------------------
@@ -48,9 +72,37 @@ def obs_scatter(datetime, conf):
     # Figure file type (pdf, png, etc)
     file_type = utils.configGet(conf, 'figure file type', 'png')
 
+    # Read all channels at once or one at a time
+    read_all_channels = utils.configGet(conf, 'read all channels', True)
+
+    # Number of processes rendering the figures
+    render_workers = utils.configGet(conf, 'render workers', 1)
+
+    # Draw every observation (scatter) or the number of observations in bins (density)
+    plot_style = utils.configGet(conf, 'plot style', 'scatter')
+    if plot_style not in ['scatter', 'density']:
+        utils.abort('obs_scatter: plot style must be scatter or density')
+
+    # Number of bins along each axis for the density plot
+    density_bins = utils.configGet(conf, 'density bins', 200)
+
+    # Observations used according to their QC flags
+    qc_filter = utils.configQCFilter(conf)
+
+    # Pair the observations by location and time
+    match_observations = utils.configGet(conf, 'match observations', True)
+    match_distance = utils.configGet(conf, 'match distance', 0.1)
+    match_time = utils.configGet(conf, 'match time', 1.0)
+
+
+    # Figures are rendered as their data is ready, in parallel with the reading of the next ones
+    # when there is more than one render worker
+    # -------------------------------------------------------------------------------------------
+    render = render_init(render_workers)
 
     # Loop over hofx files
     # --------------------
+    utils_profile.phase('read')
     for ioda_exp_file, ioda_ref_file in zip(ioda_exp_files, ioda_ref_files):
 
         # Replace datetime in input filenames
@@ -75,7 +127,7 @@ def obs_scatter(datetime, conf):
         fh_ref = netCDF4.Dataset(ioda_ref_file)
 
         # Get potential variables
-        variables = fh_exp.groups['hofx'].variables.keys()
+        variables = list(fh_exp.groups['hofx'].variables.keys())
 
         # Check for channels
         try:
@@ -92,6 +144,46 @@ def obs_scatter(datetime, conf):
             assert not any(channels_exp != channels_ref), \
                          "Files being compared have different channels"
 
+        # Close files, the data is read by utils.read_ioda_file and netCDF does not allow a second
+        # handle to a file that is already open
+        fh_exp.close()
+        fh_ref.close()
+
+        # Indices of the observations of each file that are the same observation
+        if match_observations:
+            utils_profile.phase('read')
+            meta_fields = [('MetaData', 'longitude'), ('MetaData', 'latitude'),
+                           ('MetaData', 'datetime')]
+            nlocs_exp, meta_exp = utils.read_ioda_file(ioda_exp_file, meta_fields)
+            nlocs_ref, meta_ref = utils.read_ioda_file(ioda_ref_file, meta_fields)
+
+            utils_profile.phase('compute')
+            index_exp, index_ref = utils.match_locations(
+                *[meta_exp[field] for field in meta_fields],
+                *[meta_ref[field] for field in meta_fields], match_distance, match_time)
+            print(" Matched observations: ", len(index_exp),
+                  "| unmatched in experiment: ", nlocs_exp - len(index_exp),
+                  "| unmatched in reference: ", nlocs_ref - len(index_ref))
+
+        # Read every metric and variable for all channels at once, derived groups such as omb are
+        # computed once for all channels
+        if read_all_channels:
+            utils_profile.phase('read')
+            qc_fields = []
+            if qc_filter is not None:
+                qc_fields = [(qc_filter[0], variable) for variable in variables]
+            _, data_exp_all = utils.read_ioda_file(ioda_exp_file, [(exp_metric, variable)
+                                                   for exp_metric in exp_metrics
+                                                   for variable in variables] + qc_fields)
+            _, data_ref_all = utils.read_ioda_file(ioda_ref_file, [(ref_metric, variable)
+                                                   for ref_metric in ref_metrics
+                                                   for variable in variables])
+
+            # One mask of the observations accepted by QC for each variable, shared by all metrics
+            if qc_filter is not None:
+                qc_masks = {variable: utils.ioda_qc_mask(data_exp_all.pop(qc_field), qc_filter[1])
+                            for variable, qc_field in zip(variables, qc_fields)}
+
         # Loop over metrics
         # -----------------
         for exp_metric, ref_metric in zip(exp_metrics, ref_metrics):
@@ -111,6 +203,10 @@ def obs_scatter(datetime, conf):
                 variable_name_no_ = variable_name_no_.capitalize()
                 variable_name_no_fix = variable_name_no_
 
+                # Fields read from the files
+                exp_field = (exp_metric, variable)
+                ref_field = (ref_metric, variable)
+
                 # Loop over channels
                 # -------------------
                 for channel_idx in range(number_channels):
@@ -118,6 +214,7 @@ def obs_scatter(datetime, conf):
 
                     # Read the data
                     # -------------
+                    utils_profile.phase('read')
                     if has_chan:
 
                         channel = channels_exp[channel_idx]
@@ -129,39 +226,79 @@ def obs_scatter(datetime, conf):
                         print("\n    Variable: ", variable_name_no_, "(", str(channel_idx+1),
                               " of ", str(number_channels),")\n")
 
-                        data_exp = utils.read_ioda_variable(fh_exp, exp_metric, variable, channel_idx)
-                        data_ref = utils.read_ioda_variable(fh_ref, ref_metric, variable, channel_idx)
+                        if read_all_channels:
+                            data_exp = data_exp_all[exp_field][:, channel_idx]
+                            data_ref = data_ref_all[ref_field][:, channel_idx]
+                            if qc_filter is not None:
+                                qc_mask = qc_masks[variable][:, channel_idx]
+                        else:
+                            data_exp = utils.read_ioda_file(ioda_exp_file, [exp_field],
+                                                            channel_idx+1)[1][exp_field]
+                            data_ref = utils.read_ioda_file(ioda_ref_file, [ref_field],
+                                                            channel_idx+1)[1][ref_field]
+                            if qc_filter is not None:
+                                qc_field = (qc_filter[0], variable)
+                                qc = utils.read_ioda_file(ioda_exp_file, [qc_field],
+                                                          channel_idx+1)[1][qc_field]
+                                qc_mask = utils.ioda_qc_mask(qc, qc_filter[1])
 
                     else:
 
                         print("\n    Variable: ", variable_name_no_, "\n")
 
-                        data_exp = utils.read_ioda_variable(fh_exp, exp_metric, variable)
-                        data_ref = utils.read_ioda_variable(fh_ref, ref_metric, variable)
-
-
-                    # Remove missing values (<-10e10)
-                    # -------------------------------
-                    remove_idx_exp = np.where(data_exp < -10e10)[0]
-                    remove_idx_ref = np.where(data_ref < -10e10)[0]
-                    remove_idx = np.unique(np.concatenate([remove_idx_exp,remove_idx_ref]))
+                        if read_all_channels:
+                            data_exp = data_exp_all[exp_field]
+                            data_ref = data_ref_all[ref_field]
+                            if qc_filter is not None:
+                                qc_mask = qc_masks[variable]
+                        else:
+                            data_exp = utils.read_ioda_file(ioda_exp_file, [exp_field])[1]
+                            data_ref = utils.read_ioda_file(ioda_ref_file, [ref_field])[1]
+                            data_exp = data_exp[exp_field]
+                            data_ref = data_ref[ref_field]
+                            if qc_filter is not None:
+                                qc_field = (qc_filter[0], variable)
+                                qc = utils.read_ioda_file(ioda_exp_file, [qc_field])[1][qc_field]
+                                qc_mask = utils.ioda_qc_mask(qc, qc_filter[1])
+
+
+                    # Pair the observations
+                    # ---------------------
+                    utils_profile.phase('compute')
+                    if match_observations:
+                        data_exp = data_exp[index_exp]
+                        data_ref = data_ref[index_ref]
+                        if qc_filter is not None:
+                            qc_mask = qc_mask[index_exp]
+
+
+                    # Remove missing values (nan)
+                    # ---------------------------
+                    valid = ~np.isnan(data_exp) & ~np.isnan(data_ref)
+
+                    # Observations rejected by QC are removed with the missing values
+                    if qc_filter is not None:
+                        print('      Rejected by '+qc_filter[0]+': ',
+                              len(data_exp) - np.count_nonzero(qc_mask))
+                        valid = valid & qc_mask
+
+                    nremove = len(data_exp) - np.count_nonzero(valid)
 
                     make_plot = True
-                    if len(remove_idx) > 0:
-                        print('      Missing values: removing ', len(remove_idx), ' values. ',
+                    if nremove > 0:
+                        print('      Missing or rejected values: removing ', nremove, ' values. ',
                               'Original number of locations:', len(data_exp))
-                        if (len(remove_idx) != len(data_exp)):
-                            data_exp = np.delete(data_exp, remove_idx)
-                            data_ref = np.delete(data_ref, remove_idx)
+                        if (nremove != len(data_exp)):
+                            data_exp = data_exp[valid]
+                            data_ref = data_ref[valid]
                         else:
                             make_plot = False
                             print('      No data for this variable/channel, skip plotting')
 
 
-                    # Create and save the figure
-                    # --------------------------
+                    # Figure to be rendered
+                    # ---------------------
                     if make_plot:
-                        print("      Creating figure")
 
                         # Create output filename
                         output_path_fig = os.path.join(output_path, platform, variable_name)
@@ -172,25 +309,122 @@ def obs_scatter(datetime, conf):
                         output_file = os.path.splitext(output_file)[0]+'.'+file_type
 
                         # Limits for the figure
-                        data_min = min(min(data_exp), min(data_ref))
-                        data_max = max(max(data_exp), max(data_ref))
+                        data_min = min(np.min(data_exp), np.min(data_ref))
+                        data_max = max(np.max(data_exp), np.max(data_ref))
                         data_dif = data_max - data_min
+                        limits = (data_min - 0.1*data_dif, data_max + 0.1*data_dif)
+
+                        figure = {'plot style': plot_style,
+                                  'limits': limits,
+                                  'title': platform_long_name + ' | ' + variable_name_no_,
+                                  'xlabel': ref_metric_long_name,
+                                  'ylabel': exp_metric_long_name,
+                                  'output file': output_file}
+
+                        if plot_style == 'density':
+                            # Counts of (reference, experiment) pairs on the same bins for both
+                            edges = np.linspace(limits[0], limits[1], density_bins+1)
+                            figure['counts'], _, _ = np.histogram2d(data_ref, data_exp,
+                                                                    bins=[edges, edges])
+                        else:
+                            figure['data exp'] = data_exp
+                            figure['data ref'] = data_ref
+                            figure['marker size'] = marker_size
+
+                        render_submit(render, figure)
 
-                        # Create and save figure
-                        fig = plt.figure()
-                        ax = fig.add_subplot(111)
-                        plt.scatter(data_ref, data_exp, s=marker_size)
-                        plt.title(platform_long_name + ' | ' + variable_name_no_)
-                        plt.ylabel(exp_metric_long_name)
-                        plt.xlabel(ref_metric_long_name)
-                        ax.set_aspect('equal', adjustable='box')
-                        plt.xlim(data_min - 0.1*data_dif, data_max + 0.1*data_dif)
-                        plt.ylim(data_min - 0.1*data_dif, data_max + 0.1*data_dif)
-                        plt.axline((0, 0), slope=1.0, color='k')
-                        plt.savefig(output_file)
-                        plt.close('all')
-
-        # Close files
-        fh_exp.close()
-        fh_ref.close()
         print("\n\n\n")
+
+
+    # Wait for the last figures
+    # -------------------------
+    render_finish(render)
+
+# --------------------------------------------------------------------------------------------------
+
+def init_render_worker():
+
+    # Figures are only saved so workers do not need a display
+    import matplotlib
+    matplotlib.use('Agg')
+
+# --------------------------------------------------------------------------------------------------
+
+def render_init(render_workers):
+
+    # Pool of processes rendering figures and the figures waiting for them. With one worker the
+    # figures are rendered in this process.
+    render = {'executor': None, 'pending': set(), 'max pending': 2*render_workers, 'count': 0}
+    if render_workers > 1:
+        render['executor'] = concurrent.futures.ProcessPoolExecutor(
+            max_workers=render_workers, initializer=init_render_worker)
+    return render
+
+# --------------------------------------------------------------------------------------------------
+
+def render_wait(render, max_pending):
+
+    # Wait until at most max_pending figures are waiting to be rendered
+    while len(render['pending']) > max_pending:
+        done, render['pending'] = concurrent.futures.wait(
+            render['pending'], return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            print("  Saved "+future.result())
+
+# --------------------------------------------------------------------------------------------------
+
+def render_submit(render, figure):
+
+    # Render a figure, or pass it to the pool once there is room so that the data of only a few
+    # figures is held at a time
+    utils_profile.phase('render')
+    render['count'] = render['count'] + 1
+    if render['executor'] is None:
+        print("  Saved "+render_figure(figure))
+        return
+
+    render_wait(render, render['max pending'] - 1)
+    render['pending'].add(render['executor'].submit(render_figure, figure))
+
+# --------------------------------------------------------------------------------------------------
+
+def render_finish(render):
+
+    # Wait for the figures still being rendered and stop the pool
+    utils_profile.phase('render')
+    render_wait(render, 0)
+    if render['executor'] is not None:
+        render['executor'].shutdown()
+    print(" Created "+str(render['count'])+" figures")
+
+# --------------------------------------------------------------------------------------------------
+
+def render_figure(figure):
+
+    import matplotlib.colors
+    import matplotlib.pyplot as plt
+
+    limits = figure['limits']
+
+    # Create and save figure
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    if figure['plot style'] == 'density':
+        # Rows of the image are experiment bins, columns are reference bins
+        counts = np.ma.masked_equal(figure['counts'].T, 0)
+        im = ax.imshow(counts, origin='lower', extent=limits+limits, interpolation='nearest',
+                       norm=matplotlib.colors.LogNorm(), cmap='viridis')
+        fig.colorbar(im, ax=ax, label='Number of observations')
+    else:
+        plt.scatter(figure['data ref'], figure['data exp'], s=figure['marker size'])
+    plt.title(figure['title'])
+    plt.ylabel(figure['ylabel'])
+    plt.xlabel(figure['xlabel'])
+    ax.set_aspect('equal', adjustable='box')
+    plt.xlim(limits)
+    plt.ylim(limits)
+    plt.axline((0, 0), slope=1.0, color='k')
+    plt.savefig(figure['output file'])
+    plt.close(fig)
+
+    return figure['output file']
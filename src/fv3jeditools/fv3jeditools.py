@@ -4,7 +4,14 @@
 # which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
 
 import click
+import concurrent.futures
+import copy
 import fv3jeditools
+import fv3jeditools.utils_cache as utils_cache
+import fv3jeditools.utils_graph as utils_graph
+import fv3jeditools.utils_profile as utils_profile
+import os
+import sys
 from ruamel.yaml import YAML
 
 # --------------------------------------------------------------------------------------------------
@@ -16,12 +23,33 @@ from ruamel.yaml import YAML
 #   - Datetime in ISO format, allowable formats listed in fv3jeditools.utils_datetime
 #   - Configuration yaml file, e.g. application.yaml
 #
+#  Options:
+#   --final      | Final datetime (any format accepted for the first argument). When given the
+#                | application is run for every cycle from the first datetime to this datetime
+#                | in a single process.
+#   --frequency  | Hours between cycles when running a range of cycles [6]
+#   --workers    | Number of processes to spread the cycles or tasks over [1, number of CPUs
+#                | for applications]
+#   --cache      | Manifest file used to skip applications whose configuration, datetime and
+#                | input files are unchanged since a recorded successful run (see utils_cache).
+#                | With more than one worker every file below the output paths of the
+#                | configuration is recorded as an output of each run
+#   --cache-hash | Identify input files by a hash of their contents instead of size and time
+#   --profile    | Time the phases of the application (timers), optionally with cProfile
+#                | (cprofile), tracemalloc (memory) or both (full). A json report is written to
+#                | the output path of the application (see utils_profile)
+#
+#  When running a range of cycles a failure in one cycle does not stop the others. The failures
+#  are reported once all cycles have been attempted.
+#
+#  Instead of a single 'application' the yaml can contain a list of 'applications', each of which
+#  can give a 'task name' and the tasks it 'depends on' (see fv3jeditools.utils_graph). Tasks are
+#  run as soon as their dependencies complete, independent tasks run at the same time using up to
+#  --workers processes (defaults to the number of CPUs, at most one per task).
+#
 # --------------------------------------------------------------------------------------------------
 
-@click.command()
-@click.argument('isodatetime')
-@click.argument('config')
-def main(isodatetime, config):
+def read_config(config):
 
     # Configure the yaml object
     yaml = YAML(typ='safe')
@@ -31,8 +59,11 @@ def main(isodatetime, config):
     with open(config) as full_conf:
         conf = yaml.load(full_conf)
 
-    # Convert string datetime to datetime object
-    datetime = fv3jeditools.utils_datetime.stringToDateTime(isodatetime)
+    return conf
+
+# --------------------------------------------------------------------------------------------------
+
+def read_application_config(conf):
 
     # Get configuration for the application
     try:
@@ -49,6 +80,54 @@ def main(isodatetime, config):
     # Remove application name key
     del app_conf['application name']
 
+    return app_name, app_conf
+
+# --------------------------------------------------------------------------------------------------
+
+def cycle_datetimes(isodatetime, final, frequency):
+
+    # Convert string datetime to datetime object
+    datetime = fv3jeditools.utils_datetime.stringToDateTime(isodatetime)
+
+    if final is None:
+        return [datetime]
+
+    # Express both ends in the same format and build the range of cycles
+    dtformat = fv3jeditools.utils_datetime.dtformat_jedi
+    datetime_final = fv3jeditools.utils_datetime.stringToDateTime(final)
+
+    return list(fv3jeditools.utils.getDateTimes(datetime.strftime(dtformat),
+                                                datetime_final.strftime(dtformat),
+                                                frequency*3600, dtformat))
+
+# --------------------------------------------------------------------------------------------------
+
+def output_path(app_conf):
+
+    # Where the application writes its outputs
+    for key in ['output path', 'output directory']:
+        if key in app_conf:
+            return os.path.expandvars(app_conf[key])
+
+    return './'
+
+# --------------------------------------------------------------------------------------------------
+
+def run_application(application, app_name, app_conf, datetime, options={}):
+
+    # Options of the driver that change how the application is run
+    cache = options.get('cache')
+    profile = options.get('profile')
+
+    # Skip if an identical run is recorded in the cache
+    if cache is not None:
+        key = utils_cache.cache_key(app_name, app_conf, datetime, cache['hash'])
+        if utils_cache.is_cached(cache['manifest'], key):
+            print("fv3jeditools: inputs unchanged, skipping application "+app_name +
+                  " for datetime ", datetime)
+            return
+        files_before = utils_cache.output_files(app_name, app_conf, datetime)
+
     # Print information
     print("\n")
     print("fv3jeditools: calling application "+app_name+" with the config \n")
@@ -57,7 +136,172 @@ def main(isodatetime, config):
     print("\n")
 
     # Execute the application
-    getattr(fv3jeditools, app_name)(datetime, app_conf)
+    if profile is not None:
+        utils_profile.start(app_name, datetime, profile, options.get('task name'))
+    try:
+        application(datetime, app_conf)
+    finally:
+        if profile is not None:
+            utils_profile.write_report(utils_profile.stop(), output_path(app_conf))
+
+    # Record the successful run
+    if cache is not None:
+        outputs = utils_cache.find_outputs(app_name, app_conf, datetime, files_before,
+                                           cache['concurrent'])
+        utils_cache.record(cache['manifest'], key, app_name, datetime, outputs)
+
+# --------------------------------------------------------------------------------------------------
+
+def init_worker():
+
+    # Each worker process renders with its own non-interactive matplotlib
+    os.environ['MPLBACKEND'] = 'Agg'
+
+# --------------------------------------------------------------------------------------------------
+
+def run_task(app_name, app_conf, datetime, options={}):
+
+    # Import the application, only done once per process
+    application = fv3jeditools.get_application(app_name)
+
+    # Each cycle gets its own copy of the configuration in case the application modifies it.
+    # Failures, including utils.abort, are returned rather than raised.
+    failure = None
+    try:
+        run_application(application, app_name, copy.deepcopy(app_conf), datetime, options)
+    except (Exception, SystemExit) as e:
+        print("fv3jeditools: application "+app_name+" failed for ", datetime, ": ", e)
+        failure = str(e)
+
+    # Figures are not closed by the applications, free them before the next cycle
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].close('all')
+
+    return failure
+
+# --------------------------------------------------------------------------------------------------
+
+def set_cache_concurrent(options, concurrent):
+
+    # Files written by applications running at the same time cannot be told apart, every file
+    # below the output paths is then recorded as an output of each run
+    if 'cache' in options and concurrent:
+        options['cache']['concurrent'] = True
+        print("fv3jeditools: applications run at the same time, the cache records every file " +
+              "below the output paths for each run")
+
+# --------------------------------------------------------------------------------------------------
+
+def run_cycles(app_name, app_conf, datetimes, workers=1, options={}):
+
+    if workers > 1:
+
+        # Spread the cycles over a pool of processes, results are returned in cycle order
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                    initializer=init_worker) as executor:
+            results = list(executor.map(run_task, [app_name]*len(datetimes),
+                                        [app_conf]*len(datetimes), datetimes,
+                                        [options]*len(datetimes)))
+
+    else:
+
+        results = [run_task(app_name, app_conf, datetime, options) for datetime in datetimes]
+
+    return [(datetime, failure) for datetime, failure in zip(datetimes, results)
+            if failure is not None]
+
+# --------------------------------------------------------------------------------------------------
+
+def run_graph_cycles(graph, datetimes, workers, options={}):
+
+    # One pool of processes is kept for all cycles
+    executor = None
+    if workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                          initializer=init_worker)
+
+    failures = []
+    try:
+        for datetime in datetimes:
+            status, graph_failures = utils_graph.run_graph(graph, datetime, run_task, executor,
+                                                           options)
+            print("\nfv3jeditools: status of tasks for ", datetime, ": ", status, "\n")
+            failures = failures + [(datetime, task_name+": "+failure)
+                                   for task_name, failure in graph_failures]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return failures
+
+# --------------------------------------------------------------------------------------------------
+
+def report_failures(name, failures, ncycles):
+
+    if failures == []:
+        return
+
+    print("\n")
+    print("fv3jeditools: "+name+" failed "+str(len(failures))+" times over "+str(ncycles) +
+          " cycles \n")
+    for datetime, message in failures:
+        print("  ", datetime, ": ", message)
+    print("\n")
+
+    fv3jeditools.utils.abort(name+" failed "+str(len(failures))+" times")
+
+# --------------------------------------------------------------------------------------------------
+
+@click.command()
+@click.argument('isodatetime')
+@click.argument('config')
+@click.option('--final', default=None, help='Final datetime for running a range of cycles')
+@click.option('--frequency', default=6, help='Hours between cycles [6]')
+@click.option('--workers', default=None, type=int,
+              help='Number of processes to run the cycles or tasks on [1, number of CPUs '
+                   'for applications]')
+@click.option('--cache', default=None,
+              help='Manifest file for skipping applications whose inputs are unchanged')
+@click.option('--cache-hash', is_flag=True,
+              help='Identify cached input files by content hash instead of size and time')
+@click.option('--profile', default=None, type=click.Choice(utils_profile.modes),
+              help='Profile the application and write a json report next to its outputs')
+def main(isodatetime, config, final, frequency, workers, cache, cache_hash, profile):
+
+    # Read the configuration once for all cycles
+    conf = read_config(config)
+
+    # Datetimes to run the application for
+    datetimes = cycle_datetimes(isodatetime, final, frequency)
+
+    # Optional memoization and profiling of runs
+    options = {'profile': profile}
+    if cache is not None:
+        options['cache'] = {'manifest': os.path.abspath(cache), 'hash': cache_hash,
+                            'concurrent': False}
+
+    # Graph of applications
+    if 'applications' in conf:
+        graph = utils_graph.build_graph(conf['applications'])
+        workers = workers or min(os.cpu_count() or 1, len(graph))
+        set_cache_concurrent(options, workers > 1 and len(graph)*len(datetimes) > 1)
+        failures = run_graph_cycles(graph, datetimes, workers, options)
+        report_failures("applications", failures, len(datetimes))
+        return
+
+    app_name, app_conf = read_application_config(conf)
+    workers = workers or 1
+
+    # Single cycle, failures are fatal as before
+    if final is None:
+        application = fv3jeditools.get_application(app_name)
+        run_application(application, app_name, app_conf, datetimes[0], options)
+        return
+
+    # Run all cycles and report on any failures at the end
+    set_cache_concurrent(options, workers > 1 and len(datetimes) > 1)
+    failures = run_cycles(app_name, app_conf, datetimes, workers, options)
+    report_failures("application "+app_name, failures, len(datetimes))
 
 # --------------------------------------------------------------------------------------------------
 
@@ -7,7 +7,12 @@
 
 import subprocess
 import os
+import collections
+import concurrent.futures
 import datetime as dt
+import fcntl
+import functools
+import json
 import numpy as np
 import random
 import shlex
@@ -16,13 +21,20 @@ import sys
 import tarfile
 import time
 
-__all__ = ['dtformat', 'dtformatprnt','configGetOrFail','configGet','ordinalNumber',
+__all__ = ['dtformat', 'dtformatprnt','configGetOrFail','configGet','configSelection',
+           'configTimeWindows', 'configQCFilter',
+           'ordinalNumber',
            'stringReplaceDatetimeTemplate','setDateConfigFile', 'setDone', 'isDone',
+           'manifest_name', 'readManifest', 'updateManifest',
            'getDateTimes', 'createPath',
            'run_csh_command', 'run_bash_command', 'run_shell_command',
            'getFileSize', 'wait_for_batch_job', 'abort',
            'depends', 'ship2S3', 'recvS3', 'lines_that_contain',
-           'ioda_platform_dict', 'ioda_group_dict', 'read_ioda_variable']
+           'ioda_platform_dict', 'ioda_group_dict', 'read_ioda_variable',
+           'ioda_missing', 'ioda_derived_groups', 'ioda_variables',
+           'ioda_nchans', 'ioda_datetimes', 'time_bins', 'ioda_qc_mask',
+           'match_locations',
+           'read_ioda_file', 'iterate_ioda_files', 'read_ioda_files']
 
 # --------------------------------------------------------------------------------------------------
 
@@ -30,6 +42,19 @@ __all__ = ['dtformat', 'dtformatprnt','configGetOrFail','configGet','ordinalNumb
 dtformat = '%Y%m%d%H'
 dtformatprnt = '%Y%m%d %Hz'
 
+# Name of the manifest file recording completed work in a directory
+manifest_name = 'fv3jeditools_manifest.json'
+
+# Values in IODA files with a magnitude at least this large are missing
+ioda_missing = 9.0e+30
+
+# Groups that are not in IODA files but are computed from two groups that are, as first - second
+ioda_derived_groups = {
+  'omb': ('ObsValue', 'hofx'),
+  'Gsiomb': ('ObsValue', 'GsiHofX'),
+  'GsiombBc': ('ObsValue', 'GsiHofXBc'),
+}
+
 # --------------------------------------------------------------------------------------------------
 
 def stringReplaceDatetimeTemplate(isodate, string_in):
@@ -115,40 +140,260 @@ def ioda_group_dict(ioda_group):
 def read_ioda_variable(fh, group, variable, channel = None):
 
     # Users often want omb, which is not a group in the files. This special case and other special
-    # cases can be added here.
-
-    if channel == None:
-
-        if group=='omb':
-            data = fh.groups['ObsValue' ].variables[variable][:] - \
-                   fh.groups['hofx'     ].variables[variable][:]
-        elif group=='Gsiomb':
-            data = fh.groups['ObsValue' ].variables[variable][:] - \
-                   fh.groups['GsiHofX'  ].variables[variable][:]
-        elif group=='GsiombBc':
-            data = fh.groups['ObsValue' ].variables[variable][:] - \
-                   fh.groups['GsiHofXBc'].variables[variable][:]
+    # cases can be added to ioda_derived_groups.
+
+    def read(group):
+        if channel == None:
+            return fh.groups[group].variables[variable][:]
+        elif isinstance(channel, list):
+            return fh.groups[group].variables[variable][:,[chan-1 for chan in channel]]
         else:
-            data = fh.groups[group].variables[variable][:]
+            return fh.groups[group].variables[variable][:,channel-1]
 
+    if group in ioda_derived_groups:
+        minuend, subtrahend = ioda_derived_groups[group]
+        data = read(minuend) - read(subtrahend)
     else:
-
-        if group=='omb':
-            data = fh.groups['ObsValue' ].variables[variable][:,channel-1] - \
-                   fh.groups['hofx'     ].variables[variable][:,channel-1]
-        elif group=='Gsiomb':
-            data = fh.groups['ObsValue' ].variables[variable][:,channel-1] - \
-                   fh.groups['GsiHofX'  ].variables[variable][:,channel-1]
-        elif group=='GsiombBc':
-            data = fh.groups['ObsValue' ].variables[variable][:,channel-1] - \
-                   fh.groups['GsiHofXBc'].variables[variable][:,channel-1]
-        else:
-            data = fh.groups[group].variables[variable][:,channel-1]
+        data = read(group)
 
     return data
 
 # --------------------------------------------------------------------------------------------------
 
+def ioda_variables(ioda_file, group):
+
+    # Names of the variables of a group in an IODA file, for derived groups the variables that are
+    # in both groups they are computed from
+    import netCDF4
+
+    with netCDF4.Dataset(ioda_file) as fh:
+        groups = ioda_derived_groups.get(group, (group,))
+        names = [set(fh.groups[name].variables.keys()) for name in groups]
+
+    return sorted(set.intersection(*names))
+
+# --------------------------------------------------------------------------------------------------
+
+def ioda_datetimes(datetimes):
+
+    # Convert IODA datetime strings, e.g. 2020-01-01T21:00:00Z, to numpy datetime64 in seconds.
+    # The strings are cut to the 19 characters before the Z and parsed by numpy for the whole
+    # array at once, empty strings become NaT.
+    return np.asarray(datetimes).astype('S19').astype('datetime64[s]')
+
+# --------------------------------------------------------------------------------------------------
+
+def time_bins(times, begin, end, nbins = 1):
+
+    # Index of the bin of each time for nbins bins of equal length from begin to end, given as
+    # datetime objects. Times outside [begin, end] and NaT are -1, the end belongs to the last bin.
+    begin = np.datetime64(begin, 's')
+    length = (np.datetime64(end, 's') - begin).astype(np.int64)
+
+    seconds = (times - begin).astype(np.int64)
+    inside = (times >= begin) & (times <= begin + np.timedelta64(length, 's'))
+
+    bins = np.full(times.shape, -1, dtype=np.int64)
+    bins[inside] = np.minimum(seconds[inside]*nbins//length, nbins-1)
+
+    return bins
+
+# --------------------------------------------------------------------------------------------------
+
+def ioda_qc_mask(qc, accepted = [0]):
+
+    # Mask of the observations whose QC flag is one of accepted, missing flags (NaN) are rejected
+    return np.isin(qc, accepted)
+
+# --------------------------------------------------------------------------------------------------
+
+def match_locations(lons_a, lats_a, times_a, lons_b, lats_b, times_b, distance_tolerance = 0.1,
+                    time_tolerance = 1.0):
+
+    # Match the observations of two files that may hold the same observations in a different
+    # order or with some missing, e.g. runs with a different distribution or thinning. Locations
+    # are in degrees and times datetime64. Observations match when
+    #   (distance/distance_tolerance)^2 + (time difference/time_tolerance)^2 <= 1
+    # with the distance in km and the time difference in seconds. Each observation is matched at
+    # most once, closest pairs first. Returns the indices of the matched pairs in a and b.
+
+    # Identical locations and times in the same order need no search
+    valid_a = ~np.isnan(lons_a) & ~np.isnan(lats_a) & ~np.isnat(times_a)
+    if np.array_equal(lons_a, lons_b, equal_nan=True) and \
+       np.array_equal(lats_a, lats_b, equal_nan=True) and np.array_equal(times_a, times_b):
+        index = np.flatnonzero(valid_a)
+        return index, index
+
+    # Nothing to match when either file has no valid observations
+    valid_b = ~np.isnan(lons_b) & ~np.isnan(lats_b) & ~np.isnat(times_b)
+    if not np.any(valid_a) or not np.any(valid_b):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    import scipy.spatial
+
+    # Points on the unit sphere and in time, scaled so that the tolerance is a distance of one.
+    # The chord is used for the distance, the same as the great circle for small tolerances.
+    time_origin = min(np.min(times_a[valid_a]), np.min(times_b[valid_b]))
+    earth_radius = 6371.0
+    def points(lons, lats, times, valid):
+        lons = np.radians(lons[valid])
+        lats = np.radians(lats[valid])
+        seconds = (times[valid] - time_origin)/np.timedelta64(1, 's')
+        scale = earth_radius/distance_tolerance
+        return np.flatnonzero(valid), np.column_stack((scale*np.cos(lats)*np.cos(lons),
+                                                       scale*np.cos(lats)*np.sin(lons),
+                                                       scale*np.sin(lats),
+                                                       seconds/time_tolerance))
+
+    index_a, points_a = points(lons_a, lats_a, times_a, valid_a)
+    index_b, points_b = points(lons_b, lats_b, times_b, valid_b)
+
+    # All pairs within the tolerance. The trees are built without balancing, which is quicker for
+    # points that are spread evenly.
+    tree_a = scipy.spatial.cKDTree(points_a, balanced_tree=False, compact_nodes=False)
+    tree_b = scipy.spatial.cKDTree(points_b, balanced_tree=False, compact_nodes=False)
+    pairs = tree_a.sparse_distance_matrix(tree_b, 1.0, output_type='ndarray')
+    order = np.argsort(pairs['v'], kind='stable')
+    pair_a = pairs['i'][order]
+    pair_b = pairs['j'][order]
+
+    # Greedy one to one assignment, closest pairs first. A pair that is the closest remaining pair
+    # of both its observations is the one the greedy assignment takes, so each round takes all of
+    # those and removes the pairs of the observations it matched. Co-located duplicates are
+    # matched in turn.
+    matched_a = []
+    matched_b = []
+    while pair_a.size > 0:
+        first_a = np.zeros(pair_a.size, dtype=bool)
+        first_a[np.unique(pair_a, return_index=True)[1]] = True
+        first_b = np.zeros(pair_b.size, dtype=bool)
+        first_b[np.unique(pair_b, return_index=True)[1]] = True
+        take = first_a & first_b
+        matched_a.append(pair_a[take])
+        matched_b.append(pair_b[take])
+        keep = ~np.isin(pair_a, pair_a[take]) & ~np.isin(pair_b, pair_b[take])
+        pair_a = pair_a[keep]
+        pair_b = pair_b[keep]
+
+    matched_a = np.concatenate(matched_a) if matched_a else np.empty(0, dtype=np.int64)
+    matched_b = np.concatenate(matched_b) if matched_b else np.empty(0, dtype=np.int64)
+
+    # Pairs in the order of a
+    order = np.argsort(matched_a)
+    return index_a[matched_a[order]], index_b[matched_b[order]]
+
+# --------------------------------------------------------------------------------------------------
+
+def ioda_nchans(ioda_file):
+
+    # Number of channels in an IODA file, 0 if the file does not have channels
+    import netCDF4
+
+    with netCDF4.Dataset(ioda_file) as fh:
+        if 'nchans' in fh.dimensions:
+            return fh.dimensions['nchans'].size
+    return 0
+
+# --------------------------------------------------------------------------------------------------
+
+def read_ioda_file(ioda_file, fields, channel = None):
+
+    # Read fields, a list of (group, variable) pairs, from one IODA file. Returns the number of
+    # locations and a dictionary with a float array for each field, with masked and missing values
+    # set to NaN. Variables with channels are read at channel (1 to nchans) if given, with shape
+    # (nlocs, len(channel)) for a list of channels and in full with shape (nlocs, nchans)
+    # otherwise. String variables such as MetaData datetime are returned as datetime64 (see
+    # ioda_datetimes).
+
+    import netCDF4
+
+    data = {}
+    with netCDF4.Dataset(ioda_file) as fh:
+
+        nlocs = fh.dimensions['nlocs'].size
+
+        # Groups in the file are read once, even when several derived groups need them
+        read = {}
+        def read_group(group, variable):
+            if (group, variable) not in read:
+                ncvar = fh.groups[group].variables[variable]
+                values = read_ioda_variable(fh, group, variable,
+                                            channel if ncvar.ndim == 2 else None)
+                if ncvar.dtype == str:
+                    values = ioda_datetimes(values)
+                else:
+                    values = np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+                    values[np.abs(values) >= ioda_missing] = np.nan
+                read[(group, variable)] = values
+            return read[(group, variable)]
+
+        for group, variable in fields:
+            if group in ioda_derived_groups:
+                minuend, subtrahend = ioda_derived_groups[group]
+                data[(group, variable)] = read_group(minuend, variable) - \
+                                          read_group(subtrahend, variable)
+            else:
+                data[(group, variable)] = read_group(group, variable)
+
+    return nlocs, data
+
+# --------------------------------------------------------------------------------------------------
+
+def iterate_ioda_files(ioda_files, fields, channel = None, workers = 1):
+
+    # Yield the number of locations and the data (see read_ioda_file) of each file in order. With
+    # workers > 1 the next files are read ahead by a pool of that many processes, no more than
+    # workers files are held waiting. The HDF5 library is not thread safe so threads cannot be
+    # used.
+
+    read = functools.partial(read_ioda_file, fields=fields, channel=channel)
+
+    workers = min(workers, len(ioda_files))
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = collections.deque()
+            for ioda_file in ioda_files:
+                futures.append(executor.submit(read, ioda_file))
+                if len(futures) > workers:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+    else:
+        for ioda_file in ioda_files:
+            yield read(ioda_file)
+
+# --------------------------------------------------------------------------------------------------
+
+def read_ioda_files(ioda_files, fields, channel = None, workers = 1):
+
+    # Read fields from IODA files that each hold part of the locations, e.g. one file per
+    # processor, and join them with the locations of the files in order. Returns the total number
+    # of locations and the data as read_ioda_file. The joined arrays are allocated once, from the
+    # number of locations of each file, and the data of each file is copied into its slice as soon
+    # as it is read (see iterate_ioda_files for workers).
+
+    import netCDF4
+
+    if ioda_files == []:
+        abort('read_ioda_files: no files to read')
+
+    offsets = [0]
+    for ioda_file in ioda_files:
+        with netCDF4.Dataset(ioda_file) as fh:
+            offsets.append(offsets[-1] + fh.dimensions['nlocs'].size)
+
+    data = {}
+    for n, (nlocs, part) in enumerate(iterate_ioda_files(ioda_files, fields, channel, workers)):
+        for field in fields:
+            values = part.pop(field)
+            if field not in data:
+                data[field] = np.empty((offsets[-1],)+values.shape[1:], dtype=values.dtype)
+            data[field][offsets[n]:offsets[n+1]] = values
+
+    return offsets[-1], data
+
+# --------------------------------------------------------------------------------------------------
+
 def configGetOrFail(conf, config_string):
 
     # File containing hofx files
@@ -176,6 +421,81 @@ def configGet(conf, config_string, default=None):
 
 # --------------------------------------------------------------------------------------------------
 
+def configSelection(conf, config_string, available):
+
+    # Key that selects one value, a list of values or all of the available values
+    selection = configGetOrFail(conf, config_string)
+
+    if selection == 'all':
+        return list(available)
+
+    if not isinstance(selection, list):
+        selection = [selection]
+
+    for value in selection:
+        if value not in available:
+            abort('\''+str(value)+'\' given for \''+config_string+'\' is not available, choose '
+                  'from: '+', '.join(str(a) for a in available))
+
+    return selection
+
+# --------------------------------------------------------------------------------------------------
+
+def configTimeWindows(conf, window_begin, window_end):
+
+    # Optional 'time range', [first, last] hours from the start of the window of the observations
+    # to use, and 'sub window length' (hours) that splits the range into sub windows. Returns the
+    # (begin, end) of each sub window and whether observation times are needed, i.e. whether
+    # anything other than the whole window was asked for.
+    try:
+        time_range = conf['time range']
+    except:
+        time_range = None
+    try:
+        sub_window_length = conf['sub window length']
+    except:
+        sub_window_length = None
+
+    if time_range is None and sub_window_length is None:
+        return [(window_begin, window_end)], False
+
+    if time_range is not None:
+        window_end = window_begin + dt.timedelta(hours=time_range[1])
+        window_begin = window_begin + dt.timedelta(hours=time_range[0])
+        if window_end <= window_begin:
+            abort('configTimeWindows: time range must be [first, last] with first < last')
+
+    if sub_window_length is None:
+        return [(window_begin, window_end)], True
+
+    nwindows = (window_end - window_begin)/dt.timedelta(hours=sub_window_length)
+    if nwindows != int(nwindows):
+        abort('configTimeWindows: sub window length must divide the window (or time range)')
+
+    length = dt.timedelta(hours=sub_window_length)
+    return [(window_begin + n*length, window_begin + (n+1)*length)
+            for n in range(int(nwindows))], True
+
+# --------------------------------------------------------------------------------------------------
+
+def configQCFilter(conf):
+
+    # Optional 'qc filter', the QC group used to select observations (e.g. EffectiveQC or PreQC),
+    # and 'qc accepted', the flags of the observations that are kept [0]. Returns the group and
+    # accepted flags, or None when observations are not filtered.
+    try:
+        qc_group = conf['qc filter']
+    except:
+        return None
+
+    qc_accepted = configGet(conf, 'qc accepted', [0])
+    if not isinstance(qc_accepted, list):
+        qc_accepted = [qc_accepted]
+
+    return qc_group, qc_accepted
+
+# --------------------------------------------------------------------------------------------------
+
 def ordinalNumber(num):
 
     # File containing hofx files
@@ -461,11 +781,47 @@ def abort(message):
 # --------------------------------------------------------------------------------------------------
 
 
+def readManifest(manifest_file):
+
+    # Return the entries of a manifest, empty if it does not exist yet
+    if not os.path.exists(manifest_file):
+        return {}
+
+    with open(manifest_file) as fh:
+        return json.load(fh)
+
+# --------------------------------------------------------------------------------------------------
+
+
+def updateManifest(manifest_file, key, entry):
+
+    # Add or replace an entry in the manifest. The manifest may be shared by several processes so
+    # the read, update and write are done under an exclusive lock.
+
+    createPath(os.path.dirname(os.path.abspath(manifest_file)))
+
+    with open(manifest_file+'.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        manifest = readManifest(manifest_file)
+        manifest[key] = entry
+
+        # Write to a temporary file and move so readers never see a partial manifest
+        with open(manifest_file+'.tmp', 'w') as fh:
+            json.dump(manifest, fh, indent=2, sort_keys=True)
+        os.replace(manifest_file+'.tmp', manifest_file)
+
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+# --------------------------------------------------------------------------------------------------
+
+
 def isDone(path, funcname):
 
-    filename = os.path.join(path, funcname)
+    manifest = readManifest(os.path.join(path, manifest_name))
 
-    if os.path.exists(filename):
+    # Marker files written before the manifest are still honoured
+    if funcname in manifest or os.path.exists(os.path.join(path, funcname)):
         print(" \n Function: "+funcname+" is complete")
         return True
     else:
@@ -478,17 +834,15 @@ def isDone(path, funcname):
 def setDone(path, funcname):
 
     print(" Function: "+funcname+" is complete")
-    filename = os.path.join(path, funcname)
-    open(filename, 'a').close()
+    updateManifest(os.path.join(path, manifest_name), funcname,
+                   {'completed': dt.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')})
 
 # --------------------------------------------------------------------------------------------------
 
 
 def depends(path, func, funcdepends):
 
-    filename = os.path.join(path, funcdepends)
-
-    if os.path.exists(filename):
+    if isDone(path, funcdepends):
         print(" Dependencies of "+func+" are complete")
         return
     else:
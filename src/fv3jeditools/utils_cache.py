@@ -0,0 +1,216 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import glob
+import hashlib
+import json
+import os
+import time
+
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package utils_cache
+#
+#  Memoization of applications run by the driver. A run is identified by a key built from:
+#
+#   - the application name
+#   - the configuration, normalized by sorting the keys
+#   - the datetime
+#   - the size and modification time (or optionally the contents) of every existing file that
+#     the configuration refers to, after environment variables are replaced and, for the keys
+#     the application fills in with the datetime (datetime_keys), the datetime template
+#
+#  Successful runs are recorded in a manifest (see utils.updateManifest) together with the files
+#  they wrote. A run whose key is in the manifest and whose outputs all still exist is skipped.
+#
+#  Outputs are the files below the paths given by the output keys of the configuration (or the
+#  current directory if there are none) that the run created or changed. They are found by
+#  comparing the size, modification time, change time and inode of the files before and after the
+#  run, so that files whose modification time is kept, e.g. extracted from a tar file, are found.
+#  When several applications run at the same time, e.g. with --workers, a changed file may belong
+#  to another application, so every file below the output paths is recorded.
+#
+# --------------------------------------------------------------------------------------------------
+
+# Configuration keys that hold locations written to by the applications
+output_keys = ['output path', 'output directory', 'path to extract to', 'created tar file']
+
+# Configuration keys that each application fills in with the datetime (datetime.strftime), the
+# strings of other keys are used as they are
+datetime_keys = {
+    'da_block_convergence': ['log file', 'log archive'],
+    'da_convergence': ['log file', 'log archive'],
+    'field_plot': ['fields file'],
+    'gsidiag_to_ioda': ['input directory', 'output directory', 'filename template'],
+    'hofx_innovations': ['hofx files', 'histogram files'],
+    'hofx_map': ['hofx files'],
+    'log_timing': ['log file', 'log archive'],
+    'obs_scatter': ['ioda experiment files', 'ioda reference files'],
+    'tar': ['files to tar', 'created tar file'],
+    'untar': ['tar files', 'internal files'],
+}
+
+# --------------------------------------------------------------------------------------------------
+
+def config_strings(conf, key=None):
+
+    # Yield every (key, string) pair in a nested configuration
+    if isinstance(conf, dict):
+        for k, v in conf.items():
+            yield from config_strings(v, k)
+    elif isinstance(conf, list):
+        for v in conf:
+            yield from config_strings(v, key)
+    elif isinstance(conf, str):
+        yield key, conf
+
+# --------------------------------------------------------------------------------------------------
+
+def resolve_path(app_name, key, string, datetime):
+
+    # Path as the application uses it
+    if key in datetime_keys.get(app_name, []):
+        string = datetime.strftime(string)
+    return os.path.expandvars(string)
+
+# --------------------------------------------------------------------------------------------------
+
+def file_groups(conf):
+
+    # Yield the wildcards of groups of files given relative to an input path, as in stage_files
+    if isinstance(conf, dict):
+        if 'input path' in conf and 'files' in conf:
+            for file in conf['files']:
+                yield os.path.join(conf['input path'], file)
+        for v in conf.values():
+            yield from file_groups(v)
+    elif isinstance(conf, list):
+        for v in conf:
+            yield from file_groups(v)
+
+# --------------------------------------------------------------------------------------------------
+
+def input_files(app_name, conf, datetime):
+
+    # Existing files the configuration refers to, possibly through wildcards. Wildcards without a
+    # directory are only meaningful relative to another key and are not expanded on their own.
+    strings = [(key, string) for key, string in config_strings(conf)
+               if key not in output_keys and '\n' not in string]
+    strings = strings + [(None, string) for string in file_groups(conf)]
+
+    files = set()
+    for key, string in strings:
+        path = resolve_path(app_name, key, string, datetime)
+        if glob.has_magic(path):
+            if os.sep in path:
+                files.update(f for f in glob.glob(path) if os.path.isfile(f))
+        elif os.path.isfile(path):
+            files.add(path)
+
+    return sorted(files)
+
+# --------------------------------------------------------------------------------------------------
+
+def file_fingerprint(path, hash_contents=False):
+
+    if hash_contents:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    stat = os.stat(path)
+    return str(stat.st_size)+':'+str(stat.st_mtime_ns)
+
+# --------------------------------------------------------------------------------------------------
+
+def cache_key(app_name, conf, datetime, hash_contents=False):
+
+    inputs = {path: file_fingerprint(path, hash_contents) for path in
+              input_files(app_name, conf, datetime)}
+
+    identity = json.dumps({'application name': app_name,
+                           'config': conf,
+                           'datetime': datetime.strftime('%Y-%m-%dT%H:%M:%S'),
+                           'inputs': inputs}, sort_keys=True, default=str)
+
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+# --------------------------------------------------------------------------------------------------
+
+def is_cached(manifest_file, key):
+
+    entry = utils.readManifest(manifest_file).get(key)
+    if entry is None:
+        return False
+
+    # Outputs must still be there for the previous run to count
+    missing = [output for output in entry['outputs'] if not os.path.lexists(output)]
+    if missing != []:
+        print("fv3jeditools: "+str(len(missing))+" outputs of the previous run are missing")
+        return False
+
+    return True
+
+# --------------------------------------------------------------------------------------------------
+
+def output_files(app_name, conf, datetime):
+
+    # Signature of every file below the paths of the output keys, or in the current directory if
+    # there are none. The signature changes whenever a file is written, even if its modification
+    # time is set back.
+    files = {}
+    roots = [(resolve_path(app_name, key, string, datetime), True)
+             for key, string in config_strings(conf) if key in output_keys]
+    if roots == []:
+        roots = [(os.getcwd(), False)]
+
+    def signature(path):
+        stat = os.lstat(path)
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino]
+
+    for root_path, recursive in roots:
+        if os.path.isdir(root_path):
+            for root, dirs, names in os.walk(root_path):
+                for name in names:
+                    path = os.path.abspath(os.path.join(root, name))
+                    files[path] = signature(path)
+                if not recursive:
+                    break
+        elif os.path.lexists(root_path):
+            files[os.path.abspath(root_path)] = signature(root_path)
+
+    return files
+
+# --------------------------------------------------------------------------------------------------
+
+def find_outputs(app_name, conf, datetime, files_before, concurrent=False):
+
+    # Outputs of a run given the output files (see output_files) from before it. Runs at the same
+    # time as other applications record every output file.
+    files_after = output_files(app_name, conf, datetime)
+    if concurrent:
+        return sorted(files_after)
+
+    return sorted(path for path, signature in files_after.items()
+                  if files_before.get(path) != signature)
+
+# --------------------------------------------------------------------------------------------------
+
+def record(manifest_file, key, app_name, datetime, outputs):
+
+    # The manifest and its lock may sit among the outputs
+    manifest_path = os.path.abspath(manifest_file)
+    outputs = [output for output in outputs if not output.startswith(manifest_path)]
+
+    utils.updateManifest(manifest_file, key,
+                         {'application name': app_name,
+                          'datetime': datetime.strftime('%Y-%m-%dT%H:%M:%S'),
+                          'completed': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                          'outputs': outputs})
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,159 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import concurrent.futures
+
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package utils_graph
+#
+#  Dependency graph of applications for the driver. The graph is built from the 'applications'
+#  list of the driver yaml, where each entry is a normal application configuration with two
+#  additional keys:
+#
+#  task name  | Name of the task in the graph [application name], must be unique
+#  depends on | List of task names that must complete successfully before this task can run
+#
+#  The completion state of each task is held in memory while the graph runs. Tasks whose
+#  dependencies have all completed are run together when an executor is provided.
+#
+# --------------------------------------------------------------------------------------------------
+
+def build_graph(apps_conf):
+
+    graph = {}
+    for app_conf in apps_conf:
+
+        # Do not modify the configuration that was passed in
+        app_conf = dict(app_conf)
+
+        app_name = utils.configGetOrFail(app_conf, 'application name')
+        task_name = app_conf.pop('task name', app_name)
+        depends = app_conf.pop('depends on', [])
+        del app_conf['application name']
+
+        # Allow a single dependency to be given without a list
+        if isinstance(depends, str):
+            depends = [depends]
+
+        if task_name in graph:
+            utils.abort('Task \''+task_name+'\' appears more than once in applications, use '
+                        '\'task name\' to give each task a unique name')
+
+        graph[task_name] = {'application name': app_name,
+                            'config': app_conf,
+                            'depends on': depends}
+
+    # Check that dependencies exist
+    for task_name, task in graph.items():
+        for depend in task['depends on']:
+            if depend not in graph:
+                utils.abort('Task \''+task_name+'\' depends on \''+depend+'\', which is not '
+                            'in applications')
+
+    # Return the graph with tasks in an order that respects dependencies
+    return {task_name: graph[task_name] for task_name in topological_order(graph)}
+
+# --------------------------------------------------------------------------------------------------
+
+def topological_order(graph):
+
+    # Number of unfinished dependencies for each task
+    remaining = {task_name: len(task['depends on']) for task_name, task in graph.items()}
+
+    order = []
+    ready = [task_name for task_name in graph if remaining[task_name] == 0]
+    while ready != []:
+        task_name = ready.pop(0)
+        order.append(task_name)
+        for other_name, other in graph.items():
+            if task_name in other['depends on']:
+                remaining[other_name] = remaining[other_name] - 1
+                if remaining[other_name] == 0:
+                    ready.append(other_name)
+
+    if len(order) != len(graph):
+        cyclic = [task_name for task_name in graph if task_name not in order]
+        utils.abort('Dependencies of applications form a cycle involving: '+', '.join(cyclic))
+
+    return order
+
+# --------------------------------------------------------------------------------------------------
+
+def task_options(options, task_name):
+
+    # Options passed to run_task for one task, the task name tells the runs of a graph apart
+    return dict(options, **{'task name': task_name})
+
+# --------------------------------------------------------------------------------------------------
+
+def run_graph(graph, datetime, run_task, executor=None, options={}):
+
+    # Run every task of the graph for datetime. run_task(app_name, app_conf, datetime, options)
+    # returns None on success or a message on failure. Returns the final status of each task and
+    # the failures.
+
+    status = {task_name: 'waiting' for task_name in graph}
+    failures = []
+    running = {}
+
+    while True:
+
+        # Tasks that can no longer run because a dependency did not complete. The graph is in
+        # dependency order so this propagates in a single pass.
+        for task_name, task in graph.items():
+            if status[task_name] == 'waiting' and \
+               any(status[depend] in ['failed', 'skipped'] for depend in task['depends on']):
+                print("fv3jeditools: skipping task "+task_name+", a dependency did not complete")
+                status[task_name] = 'skipped'
+
+        # Tasks whose dependencies are all complete
+        ready = [task_name for task_name, task in graph.items() if status[task_name] == 'waiting'
+                 and all(status[depend] == 'done' for depend in task['depends on'])]
+
+        if executor is None:
+
+            # Run one task at a time in this process
+            if ready == []:
+                break
+            task_name = ready[0]
+            task = graph[task_name]
+            failure = run_task(task['application name'], task['config'], datetime,
+                               task_options(options, task_name))
+            set_status(status, failures, task_name, failure)
+
+        else:
+
+            # Submit everything that is ready and wait for any task to finish
+            for task_name in ready:
+                task = graph[task_name]
+                future = executor.submit(run_task, task['application name'], task['config'],
+                                         datetime, task_options(options, task_name))
+                running[future] = task_name
+                status[task_name] = 'running'
+
+            if running == {}:
+                break
+
+            done, _ = concurrent.futures.wait(running,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                set_status(status, failures, running.pop(future), future.result())
+
+    return status, failures
+
+# --------------------------------------------------------------------------------------------------
+
+def set_status(status, failures, task_name, failure):
+
+    if failure is None:
+        print("fv3jeditools: task "+task_name+" is complete")
+        status[task_name] = 'done'
+    else:
+        status[task_name] = 'failed'
+        failures.append((task_name, failure))
+
+# --------------------------------------------------------------------------------------------------
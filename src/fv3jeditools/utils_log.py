@@ -0,0 +1,427 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import bz2
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import mmap
+import os
+import re
+import tarfile
+
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package utils_log
+#
+#  Parser of OOPS logs shared by the log diagnostics. The log is read once, line by line, and a
+#  record is yielded for each line of interest:
+#
+#  ('minimizer', name)                         | Minimizer algorithm=DRIPCG
+#  ('iteration', minimizer, iteration)         | DRIPCG end of iteration 3
+#  ('iteration value', minimizer, name, value) | Gradient reduction, Norm reduction, J, Jb and JoJc
+#                                              | in the lines following the end of an iteration
+#  ('members', name, values)                   | Norm reduction and J of all members of a block
+#  ('timing', table, name, values)             | Rows of the Timing Statistics and Parallel Timing
+#                                              | Statistics tables
+#
+#  The records are collected into series (see log_series_init) that hold plain lists so that they
+#  can be written as JSON. The state of the parser is kept in a dictionary so that a log can be
+#  parsed in pieces, e.g. as it is written.
+#
+#  Logs compressed with gzip, bzip2 or xz (.gz, .bz2 or .xz) and logs inside tar archives are
+#  decompressed as they are parsed, without temporary files (see open_log).
+#
+#  read_log maps plain logs into memory and finds the sections that can hold records with bytes.find
+#  (see log_sections). Only those sections are decoded and parsed, the rest of the log, usually
+#  most of it, is never turned into Python strings.
+#
+#  A log that is still being written can be followed with log_follow_update, which parses the
+#  lines added since the last update.
+#
+#  read_log can keep the series of a log in a JSON cache file so that plotting the same log again
+#  does not parse it again. The cache is used while the size, modification time and the first and
+#  last bytes of the log are unchanged.
+#
+# --------------------------------------------------------------------------------------------------
+
+# Names of the values that follow the end of an iteration
+iteration_values = ['Gradient reduction', 'Norm reduction', 'J', 'Jb', 'JoJc']
+
+# Names of the tables of timings
+timing_tables = ['Timing Statistics', 'Parallel Timing Statistics']
+
+# Lines after the end of an iteration that hold its values
+iteration_lines = 6
+
+# Markers of the lines that can hold records outside of the timing tables, with the number of
+# lines after the marker that belong to its section
+section_markers = [(b' end of iteration ', iteration_lines),
+                   (b'all members', 0)]
+
+# Marker of the first and last line of a timing table
+timing_marker = b'Timing Statistics'
+
+# Openers of compressed logs by extension
+compressed_log_openers = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+# Version of the series, increased when the parser changes so that older caches are not used
+series_version = 2
+
+# Bytes at the start and end of a log that are hashed to identify it
+identity_bytes = 1 << 16
+
+# Patterns, only tried on lines that contain the text they start with
+pattern_reduction = re.compile(r'\s*(Gradient reduction|Norm reduction)\s*\(')
+pattern_cost = re.compile(r'\s*Quadratic cost function:\s*(JoJc|Jb|J)\s*\(')
+pattern_members = re.compile(r'\s*(Norm reduction all members|Quadratic cost function all '
+                             r'members:\s*J)\s*\(')
+pattern_timing_marker = re.compile(r'OOPS_STATS -+ (Parallel Timing Statistics|Timing '
+                                   r'Statistics)')
+
+# --------------------------------------------------------------------------------------------------
+
+def log_state_init():
+
+    # Where the parser is in the log: the minimizer and number of lines since the last end of
+    # iteration and the timing table being read
+    return {'minimizer': None,
+            'since iteration': iteration_lines,
+            'table': None}
+
+# --------------------------------------------------------------------------------------------------
+
+def log_records(lines, state=None):
+
+    # Yield the records of the lines of a log. Lines that cannot hold a record are rejected by a
+    # substring test before any pattern is tried. The state is held in local variables while the
+    # lines are read and stored in state before each record is yielded and at the end.
+
+    if state is None:
+        state = log_state_init()
+    minimizer = state['minimizer']
+    since_iteration = state['since iteration']
+    table = state['table']
+
+    def save_state():
+        state['minimizer'] = minimizer
+        state['since iteration'] = since_iteration
+        state['table'] = table
+
+    for line in lines:
+
+        since_iteration = since_iteration + 1
+        record = None
+
+        # Timing tables
+        if line.startswith('OOPS_STATS'):
+            if 'Timing Statistics' in line:
+                match = pattern_timing_marker.match(line)
+                if match:
+                    table = None if table == match.group(1) else match.group(1)
+            elif table is not None and line.startswith('OOPS_STATS oops'):
+                name, _, values = line.partition(': ')
+                try:
+                    record = ('timing', table, name.split()[1],
+                              [float(value) for value in values.split()])
+                except ValueError:
+                    pass
+
+        # Minimizer iterations
+        elif ' end of iteration ' in line:
+            words = line.split()
+            try:
+                iteration = int(words[-1])
+            except ValueError:
+                continue
+            minimizer = words[0]
+            since_iteration = 0
+            record = ('iteration', minimizer, iteration)
+
+        # Values of all members of a block
+        elif 'all members' in line:
+            match = pattern_members.match(line)
+            if match:
+                name = 'Norm reduction' if match.group(1).startswith('Norm') else 'J'
+                values = line.rpartition('=')[2].replace(',', ' ').split()
+                try:
+                    record = ('members', name, [float(value) for value in values])
+                except ValueError:
+                    pass
+
+        # Values of the last iteration
+        elif since_iteration <= iteration_lines and ('reduction' in line or 'Quadratic' in line):
+            match = pattern_reduction.match(line) or pattern_cost.match(line)
+            if match:
+                try:
+                    record = ('iteration value', minimizer, match.group(1),
+                              float(line.split()[-1]))
+                except ValueError:
+                    pass
+
+        elif 'Minimizer algorithm=' in line:
+            record = ('minimizer', line.split('=')[1].strip())
+
+        if record is not None:
+            save_state()
+            yield record
+
+    save_state()
+
+# --------------------------------------------------------------------------------------------------
+
+def log_series_init():
+
+    # Series collected from the records
+    #  minimizer  | Minimizer algorithm of the run, None until found
+    #  iterations | For each minimizer, in the order they appear, a list of each iteration value
+    #  members    | For Norm reduction and J, a list with the values of all members per iteration
+    #  timing     | For each table the method names and their values
+    return {'minimizer': None,
+            'iterations': {},
+            'members': {'Norm reduction': [], 'J': []},
+            'timing': {table: {'names': [], 'values': []} for table in timing_tables}}
+
+# --------------------------------------------------------------------------------------------------
+
+def log_series_update(series, records):
+
+    # Add records to the series, returns the number of records added
+    nrecords = 0
+    for record in records:
+        nrecords = nrecords + 1
+        kind = record[0]
+        if kind == 'iteration':
+            if record[1] not in series['iterations']:
+                series['iterations'][record[1]] = {name: [] for name in iteration_values}
+        elif kind == 'iteration value':
+            series['iterations'][record[1]][record[2]].append(record[3])
+        elif kind == 'members':
+            series['members'][record[1]].append(record[2])
+        elif kind == 'timing':
+            series['timing'][record[1]]['names'].append(record[2])
+            series['timing'][record[1]]['values'].append(record[3])
+        elif kind == 'minimizer' and series['minimizer'] is None:
+            series['minimizer'] = record[1]
+
+    return nrecords
+
+# --------------------------------------------------------------------------------------------------
+
+@contextlib.contextmanager
+def open_log(log_file, archive=None):
+
+    # Text stream of the lines of a log, decompressed while it is read when the name ends with
+    # .gz, .bz2 or .xz. With archive the log is the member log_file of that tar archive, which may
+    # itself be compressed, and is read from the archive without being extracted.
+    opener = compressed_log_openers.get(os.path.splitext(log_file)[1], None)
+
+    with contextlib.ExitStack() as stack:
+
+        if archive is None:
+            fh = stack.enter_context(open(log_file, 'rb'))
+        else:
+            tar = stack.enter_context(tarfile.open(archive, 'r:*'))
+            try:
+                fh = tar.extractfile(log_file)
+            except KeyError:
+                fh = None
+            if fh is None:
+                utils.abort('Log file '+log_file+' not found in archive '+archive+'.')
+            stack.enter_context(fh)
+
+        if opener is not None:
+            fh = stack.enter_context(opener(fh, 'rb'))
+
+        yield io.TextIOWrapper(fh, encoding='utf-8', errors='replace')
+
+# --------------------------------------------------------------------------------------------------
+
+def log_sections(mm):
+
+    # Byte ranges [start, end) of whole lines of the log mm (a bytes like object) that can hold
+    # records, in order and without overlaps
+
+    def line_start(pos):
+        return mm.rfind(b'\n', 0, pos) + 1
+
+    def line_end(pos, nlines=0):
+        for _ in range(nlines+1):
+            pos = mm.find(b'\n', pos)
+            if pos < 0:
+                return len(mm)
+            pos = pos + 1
+        return pos
+
+    sections = []
+
+    # Lines with a marker and the lines that follow it
+    for marker, nlines in section_markers:
+        pos = mm.find(marker)
+        while pos >= 0:
+            sections.append((line_start(pos), line_end(pos, nlines)))
+            pos = mm.find(marker, sections[-1][1])
+
+    # The minimizer algorithm is only needed once
+    pos = mm.find(b'Minimizer algorithm=')
+    if pos >= 0:
+        sections.append((line_start(pos), line_end(pos)))
+
+    # Timing tables from their first to last line, a table that is not finished goes to the end
+    pos = mm.find(timing_marker)
+    while pos >= 0:
+        close = mm.find(timing_marker, line_end(pos))
+        sections.append((line_start(pos), line_end(close) if close >= 0 else len(mm)))
+        pos = mm.find(timing_marker, sections[-1][1]) if close >= 0 else -1
+
+    # Join overlapping sections
+    merged = []
+    for start, end in sorted(sections):
+        if merged != [] and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+# --------------------------------------------------------------------------------------------------
+
+def log_identity(log_file):
+
+    # Identity of a log for the cache: its path, size, modification time and a hash of its first
+    # and last bytes, which catches logs replaced within the resolution of the modification time
+    stat = os.stat(log_file)
+    sha = hashlib.sha256()
+    with open(log_file, 'rb') as fh:
+        sha.update(fh.read(identity_bytes))
+        if stat.st_size > identity_bytes:
+            fh.seek(max(identity_bytes, stat.st_size - identity_bytes))
+            sha.update(fh.read())
+
+    return {'path': os.path.abspath(log_file),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'hash': sha.hexdigest(),
+            'version': series_version}
+
+# --------------------------------------------------------------------------------------------------
+
+def log_cache_file(log_file, cache):
+
+    # Cache file of a log, next to the log when cache is true or in the directory cache. Logs with
+    # the same name in different directories are told apart by a hash of their path.
+    if cache is True:
+        return log_file+'.series.json'
+
+    path_hash = hashlib.sha256(os.path.abspath(log_file).encode('utf-8')).hexdigest()[0:12]
+    return os.path.join(cache, os.path.basename(log_file)+'.'+path_hash+'.series.json')
+
+# --------------------------------------------------------------------------------------------------
+
+def read_log(log_file, cache=False, archive=None):
+
+    # Parse a log and return its series. With cache (see log_cache_file) the
+    # series are read from the cache file when it belongs to the same log and written to it
+    # otherwise. With archive the log is a member of a tar archive (see open_log).
+    source_file = log_file if archive is None else archive
+    if not os.path.exists(source_file):
+        utils.abort('Log file not found.')
+
+    if cache:
+        if archive is None:
+            cache_file = log_cache_file(log_file, cache)
+            identity = log_identity(log_file)
+        else:
+            cache_file = log_cache_file(archive+'.'+log_file.replace(os.sep, '_'), cache)
+            identity = dict(log_identity(archive), member=log_file)
+        try:
+            with open(cache_file) as fh:
+                cached = json.load(fh)
+            if cached['identity'] == identity:
+                print(" Using parsed log from ", cache_file)
+                return cached['series']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    series = log_series_init()
+    if archive is not None or log_file.endswith(tuple(compressed_log_openers)):
+
+        # Compressed and archived logs are parsed as a stream while they are decompressed
+        with open_log(log_file, archive) as fh:
+            log_series_update(series, log_records(fh))
+
+    else:
+
+        # Parse the sections of the log. Lines between sections are not read so the count of
+        # lines since the last iteration starts again in each section.
+        with open(log_file, 'rb') as fh:
+            if os.fstat(fh.fileno()).st_size > 0:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    state = log_state_init()
+                    for start, end in log_sections(mm):
+                        state['since iteration'] = iteration_lines
+                        lines = mm[start:end].decode('utf-8', errors='replace').splitlines()
+                        log_series_update(series, log_records(lines, state))
+
+    # Write to a temporary file first so that a reader never sees a partial cache
+    if cache:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+            temp_file = cache_file+'.'+str(os.getpid())+'.tmp'
+            with open(temp_file, 'w') as fh:
+                json.dump({'identity': identity, 'series': series}, fh, separators=(',', ':'))
+            os.replace(temp_file, cache_file)
+        except OSError as error:
+            print(" Could not write the parsed log cache: ", error)
+
+    return series
+
+# --------------------------------------------------------------------------------------------------
+
+def log_follow_init():
+
+    # Position in a followed log, the parser state and the series so far
+    return {'offset': 0,
+            'state': log_state_init(),
+            'series': log_series_init(),
+            'finished': False}
+
+# --------------------------------------------------------------------------------------------------
+
+def log_follow_update(log_file, follow):
+
+    # Parse the complete lines added to log_file since the last update, an incomplete last line is
+    # left for the next update. A log that became shorter has been replaced and is parsed again
+    # from the start. Returns the number of bytes parsed and the number of records added to the
+    # series, which counts values that arrive after the line of their iteration.
+    # follow['finished'] is set once the end of the run is found in the log.
+    if not os.path.exists(log_file):
+        return 0, 0
+
+    with open(log_file, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size < follow['offset']:
+            follow.update(log_follow_init())
+        fh.seek(follow['offset'])
+        data = fh.read()
+
+    # Bytes up to the end of the last complete line
+    nbytes = data.rfind(b'\n') + 1
+    if nbytes == 0:
+        return 0, 0
+    follow['offset'] = follow['offset'] + nbytes
+
+    lines = data[0:nbytes].decode('utf-8', errors='replace').splitlines()
+    nrecords = log_series_update(follow['series'], log_records(lines, follow['state']))
+
+    if data.find(b'OOPS Ending', 0, nbytes) >= 0:
+        follow['finished'] = True
+
+    return nbytes, nrecords
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,170 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import cProfile
+import json
+import os
+import pstats
+import time
+import tracemalloc
+
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package utils_profile
+#
+#  Profiling of applications run by the driver. The applications mark the start of each phase of
+#  their work by calling phase(name), e.g. phase('read'). A phase lasts until the next call, time
+#  spent in phases that are entered more than once (e.g. read inside a loop over files) is summed.
+#  When the driver is not profiling phase() does nothing.
+#
+#  Standard phases are: config parse, file discovery, read, compute, render and save.
+#
+#  Profiling modes:
+#
+#  timers   | Wall time of each phase
+#  cprofile | Timers plus the functions with the largest cumulative time from cProfile, the full
+#           | profile is also written to a .prof file for use with pstats or snakeviz
+#  memory   | Timers plus the peak traced memory and largest allocations from tracemalloc
+#  full     | All of the above
+#
+#  The report is written as json next to the outputs of the application, the file name holds the
+#  application name, the task name when run from a graph, and the datetime.
+#
+# --------------------------------------------------------------------------------------------------
+
+# Profile of the application currently running, None when not profiling
+active = None
+
+# Profiling modes
+modes = ['timers', 'cprofile', 'memory', 'full']
+
+# Number of functions and allocation sites kept in the report
+ntop = 25
+
+# --------------------------------------------------------------------------------------------------
+
+def phase(name):
+
+    if active is None:
+        return
+
+    # Close the current phase and open the new one
+    now = time.perf_counter()
+    current, start_time = active['current']
+    timer = active['phases'].setdefault(current, {'seconds': 0.0, 'count': 0})
+    timer['seconds'] = timer['seconds'] + now - start_time
+    timer['count'] = timer['count'] + 1
+    active['current'] = (name, now)
+
+# --------------------------------------------------------------------------------------------------
+
+def start(app_name, datetime, mode='timers', task_name=None):
+
+    global active
+
+    if mode not in modes:
+        utils.abort('Profiling mode must be one of '+', '.join(modes))
+
+    active = {'application name': app_name,
+              'task name': task_name,
+              'datetime': datetime.strftime('%Y-%m-%dT%H:%M:%S'),
+              'mode': mode,
+              'phases': {},
+              'profiler': None,
+              'start': time.perf_counter()}
+
+    if mode in ['memory', 'full']:
+        tracemalloc.start()
+
+    if mode in ['cprofile', 'full']:
+        active['profiler'] = cProfile.Profile()
+        active['profiler'].enable()
+
+    # Applications begin by parsing their configuration
+    active['current'] = ('config parse', time.perf_counter())
+
+# --------------------------------------------------------------------------------------------------
+
+def stop():
+
+    # End profiling and return the report, or None if not profiling
+
+    global active
+
+    if active is None:
+        return None
+
+    profiler = active['profiler']
+    if profiler is not None:
+        profiler.disable()
+
+    phase(None)
+    del active['current']
+
+    report = active
+    active = None
+
+    report['total seconds'] = time.perf_counter() - report.pop('start')
+
+    # Most expensive functions
+    report.pop('profiler')
+    if profiler is not None:
+        stats = pstats.Stats(profiler)
+        stats.sort_stats('cumulative')
+        report['functions'] = []
+        for func in stats.fcn_list[0:ntop]:
+            _, ncalls, tottime, cumtime, _ = stats.stats[func]
+            report['functions'].append({'function': pstats.func_std_string(func),
+                                        'calls': ncalls,
+                                        'total seconds': tottime,
+                                        'cumulative seconds': cumtime})
+        report['cprofile'] = profiler
+
+    # Memory
+    if tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report['memory'] = {'current MB': current/1.0e6, 'peak MB': peak/1.0e6,
+                            'allocations': [{'location': str(stat.traceback),
+                                             'MB': stat.size/1.0e6,
+                                             'count': stat.count}
+                                            for stat in snapshot.statistics('lineno')[0:ntop]]}
+
+    return report
+
+# --------------------------------------------------------------------------------------------------
+
+def write_report(report, output_path):
+
+    # Write the report, and the full cProfile output if present, to the output path
+
+    utils.createPath(output_path)
+
+    # Tasks of a graph may run the same application with the same output path
+    savename = report['application name']
+    if report['task name'] not in [None, report['application name']]:
+        savename = savename+"_"+report['task name']
+    savename = savename+"_profile_" + \
+               report['datetime'].replace('-', '').replace(':', '').replace('T', '_')
+    savename = os.path.join(output_path, savename)
+
+    profiler = report.pop('cprofile', None)
+    if profiler is not None:
+        profiler.dump_stats(savename+'.prof')
+        report['cprofile file'] = savename+'.prof'
+
+    print(" Saving profile as", savename+'.json', "\n")
+    with open(savename+'.json', 'w') as fh:
+        json.dump(report, fh, indent=2)
+
+    # Summary of the phases
+    print(" Time per phase of "+report['application name']+":")
+    for name, timer in sorted(report['phases'].items(), key=lambda item: -item[1]['seconds']):
+        print("   {:<16s} {:10.3f} s  ({} times)".format(name, timer['seconds'], timer['count']))
+    print("   {:<16s} {:10.3f} s".format('total', report['total seconds']))
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,283 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import numpy as np
+
+import fv3jeditools.utils as utils
+
+# --------------------------------------------------------------------------------------------------
+## @package utils_stats
+#
+#  Vectorized statistics of observations for the diagnostic applications.
+#
+#  stats_init          | New accumulator of streaming statistics
+#  stats_update        | Add a chunk of values, e.g. the observations of one file
+#  stats_update_binned | Add a chunk of values to an accumulator with statistics for each bin
+#  stats_merge         | Combine two accumulators
+#  stats_final         | Count, mean, standard deviation, min, max and rms of an accumulator
+#  histogram_init      | New histogram with fixed edges
+#  histogram_update    | Add a chunk of values to a histogram
+#  histogram_merge     | Sum two histograms with the same edges
+#  histogram_save      | Write a histogram, and optionally an accumulator, to a .npz file
+#  histogram_load      | Read a histogram and accumulator written by histogram_save
+#  histogram_kde       | Gaussian kernel density estimate on the bins of a histogram
+#  silverman_bandwidth | Rule of thumb bandwidth for histogram_kde
+#  grid_edges          | Cell edges of a global lon/lat or equal-area grid
+#  grid_cells          | Grid cell of each observation
+#
+#  The accumulator is a dictionary holding the count, mean, sum of squared deviations from the
+#  mean (m2), min, max and sum of squares of the values added so far. Chunks are reduced with
+#  numpy and combined with the pairwise update of Chan et al., so statistics of any number of
+#  files are computed in one pass without holding all the observations. Every entry has the shape
+#  given to stats_init, e.g. one value per outer loop or per grid cell. NaN values are ignored.
+#
+#  Histograms have fixed edges so that histograms of different files or cycles can be summed.
+#  Counts have shape (nbins,)+shape and values outside the edges are counted as below and above.
+#
+# --------------------------------------------------------------------------------------------------
+
+def stats_init(shape=()):
+
+    return {'count': np.zeros(shape),
+            'mean': np.zeros(shape),
+            'm2': np.zeros(shape),
+            'min': np.full(shape, np.inf),
+            'max': np.full(shape, -np.inf),
+            'sumsq': np.zeros(shape)}
+
+# --------------------------------------------------------------------------------------------------
+
+def stats_merge(stats, other):
+
+    # Combine other into stats, both accumulators must have the same shape
+    count = stats['count'] + other['count']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(count > 0, other['count']/count, 0.0)
+    delta = other['mean'] - stats['mean']
+
+    stats['mean'] = stats['mean'] + delta*weight
+    stats['m2'] = stats['m2'] + other['m2'] + delta**2*stats['count']*weight
+    stats['min'] = np.minimum(stats['min'], other['min'])
+    stats['max'] = np.maximum(stats['max'], other['max'])
+    stats['sumsq'] = stats['sumsq'] + other['sumsq']
+    stats['count'] = count
+
+    return stats
+
+# --------------------------------------------------------------------------------------------------
+
+def stats_update(stats, values):
+
+    # Add values with shape (n,)+shape, statistics are along the first dimension
+    valid = ~np.isnan(values)
+    zeroed = np.where(valid, values, 0.0)
+
+    chunk = {'count': np.count_nonzero(valid, axis=0).astype(np.float64)}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        chunk['mean'] = np.where(chunk['count'] > 0, np.sum(zeroed, axis=0)/chunk['count'], 0.0)
+    chunk['m2'] = np.sum(np.where(valid, values - chunk['mean'], 0.0)**2, axis=0)
+    chunk['min'] = np.min(np.where(valid, values, np.inf), axis=0, initial=np.inf)
+    chunk['max'] = np.max(np.where(valid, values, -np.inf), axis=0, initial=-np.inf)
+    chunk['sumsq'] = np.sum(zeroed**2, axis=0)
+
+    return stats_merge(stats, chunk)
+
+# --------------------------------------------------------------------------------------------------
+
+def stats_update_binned(stats, index, values):
+
+    # Add 1D values where value i belongs to bin index[i] of an accumulator with shape (nbins,)
+    valid = ~np.isnan(values)
+    index = index[valid]
+    values = values[valid]
+    nbins = stats['count'].shape[0]
+
+    chunk = {'count': np.bincount(index, minlength=nbins).astype(np.float64)}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        chunk['mean'] = np.where(chunk['count'] > 0,
+                                 np.bincount(index, values, minlength=nbins)/chunk['count'], 0.0)
+    chunk['m2'] = np.bincount(index, (values - chunk['mean'][index])**2, minlength=nbins)
+    chunk['min'] = np.full(nbins, np.inf)
+    np.minimum.at(chunk['min'], index, values)
+    chunk['max'] = np.full(nbins, -np.inf)
+    np.maximum.at(chunk['max'], index, values)
+    chunk['sumsq'] = np.bincount(index, values**2, minlength=nbins)
+
+    return stats_merge(stats, chunk)
+
+# --------------------------------------------------------------------------------------------------
+
+def stats_final(stats):
+
+    # Statistics of everything added, NaN where nothing was added
+    count = stats['count']
+    empty = count == 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = np.where(empty, np.nan, stats['m2']/count)
+        return {'count': count,
+                'mean': np.where(empty, np.nan, stats['mean']),
+                'variance': variance,
+                'std': np.sqrt(variance),
+                'min': np.where(empty, np.nan, stats['min']),
+                'max': np.where(empty, np.nan, stats['max']),
+                'rms': np.where(empty, np.nan, np.sqrt(stats['sumsq']/count))}
+
+# --------------------------------------------------------------------------------------------------
+
+def histogram_init(edges, shape=()):
+
+    nbins = len(edges) - 1
+    return {'edges': np.asarray(edges, dtype=np.float64),
+            'counts': np.zeros((nbins,)+shape),
+            'below': np.zeros(shape),
+            'above': np.zeros(shape)}
+
+# --------------------------------------------------------------------------------------------------
+
+def histogram_update(hist, values):
+
+    # Add values with shape (n,)+shape. As for np.histogram the last bin includes the last edge.
+    edges = hist['edges']
+    nbins = len(edges) - 1
+    shape = values.shape[1:]
+
+    valid = ~np.isnan(values)
+    index = np.searchsorted(edges, values, side='right') - 1
+    index[values == edges[-1]] = nbins - 1
+
+    below = valid & (index < 0)
+    above = valid & (index >= nbins)
+    inside = valid & ~below & ~above
+
+    hist['below'] = hist['below'] + np.count_nonzero(below, axis=0)
+    hist['above'] = hist['above'] + np.count_nonzero(above, axis=0)
+
+    # Count every column with a single bincount by giving each column its own range of bins
+    ncolumns = int(np.prod(shape))
+    columns = np.broadcast_to(np.arange(ncolumns).reshape(shape), values.shape)
+    counts = np.bincount((columns*nbins + index)[inside], minlength=ncolumns*nbins)
+    hist['counts'] = hist['counts'] + counts.reshape(ncolumns, nbins).T.reshape((nbins,)+shape)
+
+    return hist
+
+# --------------------------------------------------------------------------------------------------
+
+def histogram_merge(hist, other):
+
+    if not np.array_equal(hist['edges'], other['edges']):
+        utils.abort('histogram_merge: histograms have different edges and cannot be summed')
+
+    for key in ['counts', 'below', 'above']:
+        hist[key] = hist[key] + other[key]
+
+    return hist
+
+# --------------------------------------------------------------------------------------------------
+
+def histogram_save(filename, hist, stats=None, metadata={}):
+
+    # Write the histogram, an accumulator and strings describing them to a .npz file
+    arrays = {'hist_'+key: value for key, value in hist.items()}
+    if stats is not None:
+        arrays.update({'stats_'+key: value for key, value in stats.items()})
+    arrays.update({'meta_'+key: np.array(value) for key, value in metadata.items()})
+
+    np.savez(filename, **arrays)
+
+# --------------------------------------------------------------------------------------------------
+
+def histogram_load(filename):
+
+    # Returns the histogram, the accumulator (None if not saved) and the metadata
+    hist = {}
+    stats = {}
+    metadata = {}
+    with np.load(filename) as npz:
+        for name in npz.files:
+            kind, key = name.split('_', 1)
+            if kind == 'hist':
+                hist[key] = npz[name]
+            elif kind == 'stats':
+                stats[key] = npz[name]
+            else:
+                metadata[key] = str(npz[name])
+
+    return hist, (stats if stats != {} else None), metadata
+
+# --------------------------------------------------------------------------------------------------
+
+def silverman_bandwidth(std, count):
+
+    # Rule of thumb bandwidth of a Gaussian kernel for data of standard deviation std
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 1.06*std*count**(-0.2)
+
+# --------------------------------------------------------------------------------------------------
+
+def histogram_kde(hist, bandwidth):
+
+    # Smooth the counts of a histogram by convolving each column with a Gaussian kernel of the
+    # given bandwidth (in the units of the edges, one per column). The convolution is done with
+    # FFTs for all columns at once, padded so that the ends do not wrap around. The result has
+    # the shape of the counts, is non-negative and keeps the total of the counts apart from what
+    # is smoothed beyond the first and last edges.
+
+    counts = hist['counts']
+    nbins = counts.shape[0]
+    shape = counts.shape[1:]
+    width = hist['edges'][1] - hist['edges'][0]
+
+    # Padded length, a power of two that leaves room for the kernel
+    sigma = np.maximum(np.broadcast_to(np.asarray(bandwidth, dtype=np.float64)/width, shape),
+                       1.0e-3)
+    reach = int(np.ceil(4.0*np.max(sigma)))
+    npad = 1 << int(np.ceil(np.log2(nbins + min(reach, nbins) + 1)))
+
+    # Kernel sampled at distances 0, 1, ..., -1 bins, normalized to sum to one
+    distance = np.fft.fftfreq(npad, 1.0/npad)
+    kernel = np.exp(-0.5*(distance.reshape((npad,)+(1,)*len(shape))/sigma)**2)
+    kernel = kernel/np.sum(kernel, axis=0)
+
+    smoothed = np.fft.irfft(np.fft.rfft(counts, n=npad, axis=0)*np.fft.rfft(kernel, axis=0),
+                            n=npad, axis=0)[0:nbins]
+
+    return np.maximum(smoothed, 0.0)
+
+# --------------------------------------------------------------------------------------------------
+
+def grid_edges(spacing, equal_area=False):
+
+    # Longitude and latitude edges (degrees) of a global grid with cells of spacing degrees. The
+    # equal-area grid has latitude edges equally spaced in sin(latitude) so that every cell covers
+    # the same area of the sphere.
+
+    nlon = int(round(360.0/spacing))
+    nlat = int(round(180.0/spacing))
+
+    lon_edges = np.linspace(-180.0, 180.0, nlon+1)
+    if equal_area:
+        lat_edges = np.degrees(np.arcsin(np.linspace(-1.0, 1.0, nlat+1)))
+    else:
+        lat_edges = np.linspace(-90.0, 90.0, nlat+1)
+
+    return lon_edges, lat_edges
+
+# --------------------------------------------------------------------------------------------------
+
+def grid_cells(lons, lats, lon_edges, lat_edges):
+
+    # Index of the grid cell of each location, cells are numbered along longitude first.
+    # Longitudes may be given from 0 to 360.
+    nlon = len(lon_edges) - 1
+    nlat = len(lat_edges) - 1
+
+    lons = np.mod(lons - lon_edges[0], 360.0) + lon_edges[0]
+    ilon = np.clip(np.searchsorted(lon_edges, lons, side='right') - 1, 0, nlon-1)
+    ilat = np.clip(np.searchsorted(lat_edges, lats, side='right') - 1, 0, nlat-1)
+
+    return ilat*nlon + ilon
+
+# --------------------------------------------------------------------------------------------------
+
@@ -22,6 +22,15 @@ from netCDF4 import Dataset
 # Initial time
 initial_time = time.perf_counter()
 
+# Time spent in each phase of the script, a phase lasts until the next one starts
+phase_times = {}
+current_phase = ["config parse", initial_time]
+
+def phase(name):
+    now = time.perf_counter()
+    phase_times[current_phase[0]] = phase_times.get(current_phase[0], 0.0) + now - current_phase[1]
+    current_phase[:] = [name, now]
+
 # -----------------------------------------------------------------------------
 
 # Environment variables
@@ -119,6 +128,8 @@ levels = np.array(list(map(int, args.levels.split(","))))
 
 # -----------------------------------------------------------------------------
 
+phase("read")
+
 if args.geos:
     # Check file extension
     if not args.filepath.endswith(".nc4"):
@@ -214,6 +225,7 @@ elif args.gfs:
 
 
 # Compute min/max
+phase("compute")
 if args.centered:
     vmax = np.max(np.abs(fld))
     vmin = -vmax
@@ -222,6 +234,7 @@ else:
     vmax = np.max(fld)
 
 # Open grid file
+phase("read")
 fgrid = Dataset(gridfiledir + "/fv3grid_c" + str(nx).zfill(4) + ".nc4", "r", format="NETCDF4")
 
 # Read grid vertices lons/lats
@@ -270,6 +283,8 @@ if args.ferret:
             ncferret.close()
 
 for iz in range(0, nz):
+    phase("render")
+
     # Figure title
     title = long_name + " (" + units + ") at level " + str(levels[iz]) + " - C" + str(nx)
     title = title.replace("_", " ")
@@ -342,10 +357,12 @@ for iz in range(0, nz):
         plt.colorbar(sm, orientation="vertical",shrink=0.8)
     
         # Save and close figure
+        phase("save")
         plt.savefig(output + ".png", format="png", dpi=300)
         plt.close()
     
     # Trim figure with mogrify if available
+    phase("save")
     info = subprocess.getstatusoutput('mogrify -help')
     if info[0] == 0:
         if args.ferret and "Orion" in hostname:
@@ -368,6 +385,11 @@ if args.ferret:
 
 # Final time
 final_time = time.perf_counter()
+phase(None)
+
+# Print timing of each phase
+for name, seconds in sorted(phase_times.items(), key=lambda item: -item[1]):
+    print(f" - {name}: {seconds:0.4f} seconds")
 
 # Print timing
 print(f"raster.py executed in {final_time - initial_time:0.4f} seconds")
@@ -0,0 +1,12 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import os
+import sys
+
+# Test the source tree when the package is not installed
+source_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if source_path not in sys.path:
+    sys.path.insert(0, source_path)
@@ -0,0 +1,59 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import numpy as np
+
+from fv3jeditools.utils import match_locations
+
+# --------------------------------------------------------------------------------------------------
+
+def times(n, value='2020-01-01T00:00:00'):
+    return np.full(n, np.datetime64(value, 's'))
+
+# --------------------------------------------------------------------------------------------------
+
+def test_match_duplicates():
+
+    # Three co-located observations in each file plus one other, in a different order
+    lons = np.array([10.0, 10.0, 10.0, 50.0])
+    lats = np.array([0.0, 0.0, 0.0, 5.0])
+
+    index_a, index_b = match_locations(lons, lats, times(4), lons[::-1].copy(),
+                                       lats[::-1].copy(), times(4))
+
+    assert len(index_a) == 4
+    assert len(set(index_b)) == 4
+    assert np.array_equal(lons[index_a], lons[::-1][index_b])
+
+# --------------------------------------------------------------------------------------------------
+
+def test_match_tolerance():
+
+    # Second observation of b is 1 km away and one second late, outside the 0.1 km tolerance
+    lons = np.array([10.0, 20.0])
+    lats = np.array([0.0, 0.0])
+    lats_b = np.array([0.0, 0.009])
+    times_b = times(2)
+    times_b[1] += np.timedelta64(1, 's')
+
+    index_a, index_b = match_locations(lons, lats, times(2), lons, lats_b, times_b)
+
+    assert list(index_a) == [0]
+    assert list(index_b) == [0]
+
+# --------------------------------------------------------------------------------------------------
+
+def test_match_empty():
+
+    lons = np.array([10.0, 20.0])
+    lats = np.array([0.0, 0.0])
+    empty = np.empty(0)
+
+    for arguments in [(empty, empty, times(0), lons, lats, times(2)),
+                      (lons, lats, times(2), empty, empty, times(0)),
+                      (lons, lats, times(2, 'NaT'), lons + 1.0, lats, times(2))]:
+        index_a, index_b = match_locations(*arguments)
+        assert index_a.size == 0
+        assert index_b.size == 0
@@ -0,0 +1,75 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import datetime as dt
+import os
+
+import fv3jeditools.utils_cache as utils_cache
+
+# --------------------------------------------------------------------------------------------------
+
+datetime = dt.datetime(2020, 1, 1, 0)
+
+# --------------------------------------------------------------------------------------------------
+
+def test_datetime_template_only_for_templated_keys(tmp_path):
+
+    # log_timing fills in 'log file', stage_files uses its paths as they are
+    (tmp_path / 'run_2020010100.log').write_text('log')
+    (tmp_path / 'run_%Y.log').write_text('log')
+
+    conf = {'log file': str(tmp_path / 'run_%Y%m%d%H.log')}
+    assert utils_cache.input_files('log_timing', conf, datetime) == \
+        [str(tmp_path / 'run_2020010100.log')]
+
+    conf = {'files to copy': [{'input path': str(tmp_path), 'output path': str(tmp_path / 'out'),
+                               'files': ['run_%Y.log']}]}
+    assert utils_cache.input_files('stage_files', conf, datetime) == [str(tmp_path / 'run_%Y.log')]
+
+# --------------------------------------------------------------------------------------------------
+
+def test_outputs_with_old_modification_time(tmp_path):
+
+    # Files written with an old modification time, as by tar, are outputs of the run
+    conf = {'path to extract to': str(tmp_path / 'out')}
+    (tmp_path / 'out').mkdir()
+    (tmp_path / 'out' / 'before.nc').write_text('before')
+
+    files_before = utils_cache.output_files('untar', conf, datetime)
+    extracted = tmp_path / 'out' / 'member.nc'
+    extracted.write_text('member')
+    os.utime(extracted, (0, 0))
+
+    outputs = utils_cache.find_outputs('untar', conf, datetime, files_before)
+    assert outputs == [str(extracted)]
+
+    # Runs at the same time as others record every file below the output paths
+    outputs = utils_cache.find_outputs('untar', conf, datetime, files_before, concurrent=True)
+    assert outputs == [str(tmp_path / 'out' / 'before.nc'), str(extracted)]
+
+# --------------------------------------------------------------------------------------------------
+
+def test_skip_and_invalidate(tmp_path):
+
+    manifest = str(tmp_path / 'manifest.json')
+    log_file = tmp_path / 'run.log'
+    log_file.write_text('log')
+    output = tmp_path / 'figure.png'
+    output.write_text('figure')
+
+    conf = {'log file': str(log_file), 'output path': str(tmp_path)}
+    key = utils_cache.cache_key('log_timing', conf, datetime)
+    assert not utils_cache.is_cached(manifest, key)
+
+    utils_cache.record(manifest, key, 'log_timing', datetime, [str(output)])
+    assert utils_cache.is_cached(manifest, key)
+
+    # A deleted output runs the application again
+    output.unlink()
+    assert not utils_cache.is_cached(manifest, key)
+
+    # A changed input gives a different key
+    log_file.write_text('longer log')
+    assert utils_cache.cache_key('log_timing', conf, datetime) != key
@@ -0,0 +1,97 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import concurrent.futures
+import datetime as dt
+
+import pytest
+
+import fv3jeditools.utils_graph as utils_graph
+
+# --------------------------------------------------------------------------------------------------
+
+datetime = dt.datetime(2020, 1, 1, 0)
+
+# Fetch the data, then plot and archive it, then clean up
+apps_conf = [
+    {'application name': 'remove', 'task name': 'clean', 'depends on': ['plot', 'archive']},
+    {'application name': 'hofx_map', 'task name': 'plot', 'depends on': 'fetch'},
+    {'application name': 'tar', 'task name': 'archive', 'depends on': ['fetch']},
+    {'application name': 'untar', 'task name': 'fetch', 'output path': 'data'},
+]
+
+# --------------------------------------------------------------------------------------------------
+
+def fake_run_task(failing, calls):
+
+    # run_task that records the order of the calls and fails for the tasks in failing
+    def run_task(app_name, app_conf, datetime, options):
+        calls.append(options['task name'])
+        if options['task name'] in failing:
+            return app_name+' failed'
+        return None
+
+    return run_task
+
+# --------------------------------------------------------------------------------------------------
+
+def test_build_graph_orders_by_dependency():
+
+    graph = utils_graph.build_graph(apps_conf)
+
+    assert list(graph) == ['fetch', 'plot', 'archive', 'clean']
+    assert graph['plot']['depends on'] == ['fetch']
+    assert graph['fetch'] == {'application name': 'untar', 'config': {'output path': 'data'},
+                              'depends on': []}
+
+    # The configuration passed in is not modified
+    assert apps_conf[3]['task name'] == 'fetch'
+
+
+def test_build_graph_rejects_cycles_and_unknown_tasks():
+
+    with pytest.raises(SystemExit):
+        utils_graph.build_graph([{'application name': 'tar', 'task name': 'a', 'depends on': 'b'},
+                                 {'application name': 'tar', 'task name': 'b', 'depends on': 'a'}])
+
+    with pytest.raises(SystemExit):
+        utils_graph.build_graph([{'application name': 'tar', 'depends on': 'missing'}])
+
+    with pytest.raises(SystemExit):
+        utils_graph.build_graph([{'application name': 'tar'}, {'application name': 'tar'}])
+
+# --------------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_run_graph_skips_dependents_of_failures(workers):
+
+    graph = utils_graph.build_graph(apps_conf)
+    calls = []
+    run_task = fake_run_task(['plot'], calls)
+
+    if workers == 1:
+        status, failures = utils_graph.run_graph(graph, datetime, run_task)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            status, failures = utils_graph.run_graph(graph, datetime, run_task, executor)
+
+    # archive does not depend on plot and still runs, clean is never called
+    assert status == {'fetch': 'done', 'plot': 'failed', 'archive': 'done', 'clean': 'skipped'}
+    assert failures == [('plot', 'hofx_map failed')]
+    assert calls[0] == 'fetch'
+    assert sorted(calls) == ['archive', 'fetch', 'plot']
+
+
+def test_run_graph_skips_transitive_dependents():
+
+    graph = utils_graph.build_graph(apps_conf)
+    calls = []
+
+    status, failures = utils_graph.run_graph(graph, datetime, fake_run_task(['fetch'], calls))
+
+    assert calls == ['fetch']
+    assert status == {'fetch': 'failed', 'plot': 'skipped', 'archive': 'skipped',
+                      'clean': 'skipped'}
+    assert failures == [('fetch', 'untar failed')]
@@ -0,0 +1,93 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import gzip
+
+import fv3jeditools.utils_log as utils_log
+
+# --------------------------------------------------------------------------------------------------
+
+log_lines = ["Minimizer algorithm=DRIPCG",
+             "DRIPCG end of iteration 1",
+             "  Gradient reduction (1) = 0.5",
+             "  Norm reduction (1) = 0.4",
+             "  Quadratic cost function: J   (1) = 100.0",
+             "  Quadratic cost function: Jb  (1) = 10.0",
+             "  Quadratic cost function: JoJc(1) = 90.0",
+             "   Norm reduction all members (1) = 1.0, 2.0",
+             "   Quadratic cost function all members: J (1) = 100.0, 101.0",
+             "   Quadratic cost function all members: Jb (1) = 10.0, 11.0",
+             "   Quadratic cost function all members: JoJc (1) = 90.0, 91.0",
+             "DRIPCG end of iteration 2",
+             "  Gradient reduction (2) = 0.25",
+             "   Quadratic cost function all members: J (2) = 50.0, 51.0",
+             "   Quadratic cost function all members: Jb (2) = 5.0, 5.1",
+             "OOPS Ending"]
+
+# --------------------------------------------------------------------------------------------------
+
+def parse(lines):
+
+    series = utils_log.log_series_init()
+    utils_log.log_series_update(series, utils_log.log_records(lines))
+    return series
+
+# --------------------------------------------------------------------------------------------------
+
+def test_members_only_j():
+
+    # Jb and JoJc member lines are not part of the J series
+    series = parse(log_lines)
+
+    assert series['members']['J'] == [[100.0, 101.0], [50.0, 51.0]]
+    assert series['members']['Norm reduction'] == [[1.0, 2.0]]
+    assert series['iterations']['DRIPCG']['Gradient reduction'] == [0.5, 0.25]
+    assert series['iterations']['DRIPCG']['J'] == [100.0]
+
+# --------------------------------------------------------------------------------------------------
+
+def test_damaged_lines_are_skipped():
+
+    # Lines cut while the log is written do not stop the parse
+    lines = log_lines[0:3] + ["DRIPCG end of iteration",
+                              "   Norm reduction all members (2) = 1.0, 2.",
+                              "   Norm reduction all members (2) = 1.0, x",
+                              "  Norm reduction (1) = "] + log_lines[3:]
+    series = parse(lines)
+
+    assert series['iterations']['DRIPCG']['Norm reduction'] == [0.4]
+    assert series['members']['Norm reduction'] == [[1.0, 2.0], [1.0, 2.0]]
+
+# --------------------------------------------------------------------------------------------------
+
+def test_read_log(tmp_path):
+
+    # Memory mapped, compressed and streamed parses give the same series
+    text = "\n".join(["filler line"]*50 + log_lines) + "\n"
+    (tmp_path / 'run.log').write_text(text)
+    with gzip.open(tmp_path / 'run.log.gz', 'wt') as fh:
+        fh.write(text)
+
+    expected = parse(log_lines)
+    assert utils_log.read_log(str(tmp_path / 'run.log')) == expected
+    assert utils_log.read_log(str(tmp_path / 'run.log.gz')) == expected
+
+# --------------------------------------------------------------------------------------------------
+
+def test_follow(tmp_path):
+
+    # Values that arrive in a later update than their iteration are added to the series
+    log_file = tmp_path / 'run.log'
+    log_file.write_text("\n".join(log_lines[0:2]) + "\n  Gradient red")
+
+    follow = utils_log.log_follow_init()
+    nbytes, nrecords = utils_log.log_follow_update(str(log_file), follow)
+    assert nrecords == 2 and not follow['finished']
+
+    with open(log_file, 'a') as fh:
+        fh.write("uction (1) = 0.5\nOOPS Ending\n")
+    nbytes, nrecords = utils_log.log_follow_update(str(log_file), follow)
+    assert nrecords == 1 and follow['finished']
+    assert follow['series']['iterations']['DRIPCG']['Gradient reduction'] == [0.5]
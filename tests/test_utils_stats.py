@@ -0,0 +1,120 @@
+# (C) Copyright 2021 UCAR
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+import numpy as np
+import pytest
+
+import fv3jeditools.utils_stats as utils_stats
+
+# --------------------------------------------------------------------------------------------------
+
+# Observations of three files with two outer loops each, the last file is empty
+rng = np.random.default_rng(3)
+chunks = [rng.normal(250.0, 5.0, (1000, 2)), rng.normal(260.0, 2.0, (10, 2)), np.zeros((0, 2))]
+chunks[0][[3, 17], 1] = np.nan
+
+# --------------------------------------------------------------------------------------------------
+
+def check_final(final, values):
+
+    # Compare with numpy on all values at once, the shape is that of a column
+    assert np.array_equal(final['count'], np.count_nonzero(~np.isnan(values), axis=0))
+    assert np.allclose(final['mean'], np.nanmean(values, axis=0))
+    assert np.allclose(final['variance'], np.nanvar(values, axis=0))
+    assert np.allclose(final['min'], np.nanmin(values, axis=0))
+    assert np.allclose(final['max'], np.nanmax(values, axis=0))
+    assert np.allclose(final['rms'], np.sqrt(np.nanmean(values**2, axis=0)))
+
+
+def test_stats_update_in_chunks_matches_numpy():
+
+    stats = utils_stats.stats_init((2,))
+    for chunk in chunks:
+        stats = utils_stats.stats_update(stats, chunk)
+
+    check_final(utils_stats.stats_final(stats), np.concatenate(chunks))
+
+
+def test_stats_merge_of_separate_accumulators():
+
+    # As when each file is reduced on its own and the accumulators are combined
+    parts = [utils_stats.stats_update(utils_stats.stats_init((2,)), chunk) for chunk in chunks]
+
+    merged = utils_stats.stats_init((2,))
+    for part in reversed(parts):
+        merged = utils_stats.stats_merge(merged, part)
+
+    check_final(utils_stats.stats_final(merged), np.concatenate(chunks))
+
+
+def test_stats_update_binned_matches_per_bin_stats():
+
+    values = np.concatenate([chunk[:, 0] for chunk in chunks])
+    index = np.arange(len(values)) % 4
+    index[index == 3] = 1
+
+    stats = utils_stats.stats_init((4,))
+    stats = utils_stats.stats_update_binned(stats, index[:500], values[:500])
+    stats = utils_stats.stats_update_binned(stats, index[500:], values[500:])
+    final = utils_stats.stats_final(stats)
+
+    for ibin in range(3):
+        check_final({key: value[ibin] for key, value in final.items()}, values[index == ibin])
+
+    # Nothing was added to the last bin
+    assert final['count'][3] == 0
+    assert np.isnan(final['mean'][3]) and np.isnan(final['rms'][3])
+
+# --------------------------------------------------------------------------------------------------
+
+def test_histogram_update_matches_numpy():
+
+    edges = np.linspace(240.0, 260.0, 21)
+    values = np.concatenate(chunks)
+    values[0, 0] = 260.0
+
+    hist = utils_stats.histogram_init(edges, (2,))
+    for chunk in [values[:600], values[600:]]:
+        hist = utils_stats.histogram_update(hist, chunk)
+
+    for column in range(2):
+        valid = values[:, column][~np.isnan(values[:, column])]
+        assert np.array_equal(hist['counts'][:, column], np.histogram(valid, edges)[0])
+        assert hist['below'][column] == np.count_nonzero(valid < edges[0])
+        assert hist['above'][column] == np.count_nonzero(valid > edges[-1])
+
+
+def test_histogram_merge_and_save_load(tmp_path):
+
+    edges = np.linspace(240.0, 260.0, 11)
+    parts = [utils_stats.histogram_update(utils_stats.histogram_init(edges), chunk[:, 0])
+             for chunk in chunks]
+
+    merged = utils_stats.histogram_init(edges)
+    for part in parts:
+        merged = utils_stats.histogram_merge(merged, part)
+
+    whole = utils_stats.histogram_update(utils_stats.histogram_init(edges),
+                                         np.concatenate(chunks)[:, 0])
+    for key in ['counts', 'below', 'above']:
+        assert np.array_equal(merged[key], whole[key])
+
+    # Round trip through the file written for later cycles
+    stats = utils_stats.stats_update(utils_stats.stats_init(), chunks[0][:, 0])
+    filename = str(tmp_path / 'hist.npz')
+    utils_stats.histogram_save(filename, merged, stats, {'field': 'brightness_temperature'})
+    hist, loaded_stats, metadata = utils_stats.histogram_load(filename)
+
+    for key in merged:
+        assert np.array_equal(hist[key], merged[key])
+    assert loaded_stats['count'] == stats['count']
+    assert metadata == {'field': 'brightness_temperature'}
+
+
+def test_histogram_merge_rejects_different_edges():
+
+    with pytest.raises(SystemExit):
+        utils_stats.histogram_merge(utils_stats.histogram_init([0.0, 1.0, 2.0]),
+                                    utils_stats.histogram_init([0.0, 1.0, 3.0]))